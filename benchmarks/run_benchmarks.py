@@ -0,0 +1,348 @@
+# Benchmarks for each stage of the capture pipeline and for combining SVGs.
+# Runs on any Linux box using the stand-in camera from utils/fake_hardware.py.
+#
+#   python -m benchmarks.run_benchmarks [--output results.json] [--repeat N]
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import utils.barrel as barrel
+import utils.burst as burst
+import utils.combine as combine
+import utils.fake_hardware as fake_hardware
+import utils.pipeline as pipeline
+import utils.simplify as simplify
+import utils.trace as trace
+import utils.undistort as undistort
+
+RESOLUTIONS = [(640, 480), (1280, 960), (2028, 1520)]
+COMBINE_PART_COUNTS = [10, 100, 1000]
+BURST_FRAMES = 5
+SYNTHETIC_IMAGES = 6
+
+
+# Function to draw a random dark "tool" on a light background
+def synthetic_tool_image(size, rng):
+    width, height = size
+    image = np.full((height, width, 3), 230, dtype=np.uint8)
+    noise = rng.integers(0, 20, size=image.shape, dtype=np.uint8)
+    image -= noise
+
+    # A handle and a head, like a spanner or a screwdriver
+    cx, cy = width // 2, height // 2
+    angle = float(rng.uniform(0, 180))
+    length = int(min(width, height) * rng.uniform(0.4, 0.7))
+    thickness = max(4, int(min(width, height) * rng.uniform(0.04, 0.08)))
+    box = cv2.boxPoints(((cx, cy), (length, thickness), angle)).astype(np.int32)
+    cv2.fillPoly(image, [box], (30, 30, 30))
+    head = (
+        int(cx + np.cos(np.radians(angle)) * length / 2),
+        int(cy + np.sin(np.radians(angle)) * length / 2),
+    )
+    cv2.circle(image, head, thickness * 2, (30, 30, 30), -1)
+    cv2.circle(image, head, thickness, (230, 230, 230), -1)
+    return image
+
+
+# Function to load the image sets at a resolution
+def image_sets(size, rng):
+    samples = [
+        cv2.resize(cv2.imread(path), size, interpolation=cv2.INTER_AREA)
+        for path in fake_hardware.SAMPLE_FRAMES
+    ]
+    synthetic = [synthetic_tool_image(size, rng) for _ in range(SYNTHETIC_IMAGES)]
+    return {"sample": samples, "synthetic": synthetic}
+
+
+# Function to time func(item) for each item, repeat times
+def time_stage(func, items, repeat):
+    timings = []
+    for _ in range(repeat):
+        for item in items:
+            started = time.perf_counter()
+            func(item)
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+# Function to summarise a list of timings in milliseconds
+def summarise(timings):
+    ordered = sorted(timings)
+    return {
+        "samples": len(ordered),
+        "min_ms": ordered[0],
+        "median_ms": statistics.median(ordered),
+        "mean_ms": statistics.fmean(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max_ms": ordered[-1],
+    }
+
+
+# Function to check whether tracing can run on this machine
+def tracer_available():
+    return trace.potrace is not None or shutil.which("potrace") is not None
+
+
+# Function to build a part SVG from contours, without needing potrace
+def polygon_svg(image, pixels_per_cm):
+    contours = pipeline.find_outline_contours(pipeline.threshold_image(image))
+    paths = [
+        "M" + " L".join(f"{x} {y}" for x, y in contour.reshape(-1, 2)) + " z"
+        for contour in contours
+    ]
+    height_px, width_px = image.shape[:2]
+    traced = {"transform": None, "paths": [" ".join(paths)]}
+    return trace.svg_document(traced, width_px, height_px, pixels_per_cm)
+
+
+# Function to benchmark every pipeline stage at every resolution
+def benchmark_stages(work_directory, repeat, rng):
+    results = []
+    crop_fraction = (0.15, 0.2, 0.85, 0.8)
+
+    for size in RESOLUTIONS:
+        width, height = size
+        for image_set, images in image_sets(size, rng).items():
+            record = {"image_set": image_set, "resolution": f"{width}x{height}"}
+
+            def add(stage, timings):
+                results.append({"stage": stage, **record, **summarise(timings)})
+
+            camera = fake_hardware.FakePicamera2(images)
+            camera.configure(camera.create_still_configuration(main={"size": size}))
+            add(
+                "camera_grab",
+                time_stage(lambda _: camera.capture_array("main"), images, repeat),
+            )
+
+            # Combining a burst, made of noisy copies of each image
+            stacks = [
+                np.stack(
+                    [
+                        cv2.add(image, rng.integers(0, 20, image.shape, np.uint8))
+                        for _ in range(BURST_FRAMES)
+                    ]
+                )
+                for image in images
+            ]
+            for method in burst.BURST_METHODS:
+                add(
+                    f"burst_{method}",
+                    time_stage(
+                        lambda stack: burst.stack_frames(stack, method), stacks, repeat
+                    ),
+                )
+
+            # The lens was calibrated at CALIBRATION_SIZE; scale the camera
+            # matrix to this resolution like pipeline.process_image does
+            mtx = undistort.scale_camera_matrix(
+                barrel.mtx, barrel.CALIBRATION_SIZE, size
+            )
+
+            # Building the remap tables is a one-off cost per resolution
+            add(
+                "undistort_maps_build",
+                time_stage(
+                    lambda _: undistort.build_undistort_maps(mtx, barrel.dist, size),
+                    [None],
+                    repeat,
+                ),
+            )
+            cache_directory = os.path.join(work_directory, "undistort_cache")
+            undistort.get_undistort_maps(mtx, barrel.dist, size, cache_directory)
+
+            undistorted = [
+                undistort.undistort(image, mtx, barrel.dist, cache_directory)
+                for image in images
+            ]
+            add(
+                "undistort",
+                time_stage(
+                    lambda image: undistort.undistort(
+                        image, mtx, barrel.dist, cache_directory
+                    ),
+                    images,
+                    repeat,
+                ),
+            )
+
+            h, w = undistorted[0].shape[:2]
+            crop = (
+                w * crop_fraction[0],
+                h * crop_fraction[1],
+                w * crop_fraction[2],
+                h * crop_fraction[3],
+            )
+            cropped = [
+                np.ascontiguousarray(pipeline.crop_image(image, crop))
+                for image in undistorted
+            ]
+            add(
+                "crop",
+                time_stage(
+                    lambda image: pipeline.crop_image(image, crop), undistorted, repeat
+                ),
+            )
+
+            binaries = [pipeline.threshold_image(image) for image in cropped]
+            add("threshold", time_stage(pipeline.threshold_image, cropped, repeat))
+
+            contours = [pipeline.find_outline_contours(binary) for binary in binaries]
+            add(
+                "find_contours",
+                time_stage(pipeline.find_outline_contours, binaries, repeat),
+            )
+
+            masks = [
+                pipeline.draw_outline_mask(found, image.shape)
+                for found, image in zip(contours, cropped)
+            ]
+            add(
+                "draw_mask",
+                time_stage(
+                    lambda i: pipeline.draw_outline_mask(contours[i], cropped[i].shape),
+                    range(len(cropped)),
+                    repeat,
+                ),
+            )
+
+            if tracer_available():
+                traced = [trace.trace_mask(mask) for mask in masks]
+                add("trace", time_stage(trace.trace_mask, masks, repeat))
+
+                # The scale grows with the resolution, like a high-res still
+                pixels_per_cm = pipeline.PIXELS_PER_CM * width / 640
+                tolerance_px = pipeline.SIMPLIFY_TOLERANCE_MM / 10 * pixels_per_cm
+                add(
+                    "simplify",
+                    time_stage(
+                        lambda t: simplify.simplify_traced(t, tolerance_px),
+                        traced,
+                        repeat,
+                    ),
+                )
+                traced = [simplify.simplify_traced(t, tolerance_px) for t in traced]
+            else:
+                traced = None
+                results.append(
+                    {"stage": "trace", **record, "skipped": "potrace not available"}
+                )
+
+            svg_path = os.path.join(work_directory, "part.svg")
+            if traced is not None:
+                add(
+                    "svg_write",
+                    time_stage(
+                        lambda i: trace.write_svg(
+                            svg_path,
+                            traced[i],
+                            cropped[i].shape[1],
+                            cropped[i].shape[0],
+                            pipeline.PIXELS_PER_CM,
+                        ),
+                        range(len(cropped)),
+                        repeat,
+                    ),
+                )
+    return results
+
+
+# Function to benchmark combining sessions of increasing size
+def benchmark_combine(work_directory, repeat, rng):
+    results = []
+    images = image_sets((640, 480), rng)["synthetic"]
+    part_svgs = [
+        polygon_svg(
+            pipeline.crop_image(image, (100, 100, 540, 380)), pipeline.PIXELS_PER_CM
+        )
+        for image in images
+    ]
+
+    for count in COMBINE_PART_COUNTS:
+        parts_directory = os.path.join(work_directory, f"parts_{count}")
+        os.makedirs(parts_directory, exist_ok=True)
+        svg_infos = []
+        for n in range(count):
+            svg_path = os.path.join(parts_directory, f"output_image_{n + 1}.svg")
+            with open(svg_path, "w") as f:
+                f.write(part_svgs[n % len(part_svgs)])
+            svg_infos.append({"svg_path": svg_path, "width_px": 440, "height_px": 280})
+
+        combined_svg_path = os.path.join(work_directory, "combined_output.svg")
+        record = {"parts": count}
+        timings = time_stage(
+            lambda _: combine.combine_svgs(svg_infos, combined_svg_path), [None], repeat
+        )
+        results.append({"stage": "combine_svgs", **record, **summarise(timings)})
+
+        timings = time_stage(
+            lambda _: combine.layout_svgs(svg_infos, combined_svg_path, (100, 60)),
+            [None],
+            repeat,
+        )
+        results.append({"stage": "layout_svgs", **record, **summarise(timings)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the shadowboards pipeline.")
+    parser.add_argument(
+        "-o", "--output", default="bench_results.json", help="file to write results to"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="runs of each stage per image"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed for the synthetic images"
+    )
+    args = parser.parse_args(argv)
+
+    # Anything that imports picamera2 or RPi.GPIO gets the stand-ins
+    fake_hardware.install()
+
+    rng = np.random.default_rng(args.seed)
+
+    work_directory = tempfile.mkdtemp(prefix="shadowboards_bench_")
+    try:
+        results = benchmark_stages(work_directory, args.repeat, rng)
+        results += benchmark_combine(work_directory, max(1, args.repeat // 2), rng)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "python": sys.version.split()[0],
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "trace_backend": "binding" if trace.potrace is not None else "command",
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for result in results:
+        where = result.get("resolution") or f"{result['parts']} parts"
+        label = f"{result['stage']:<22}{result.get('image_set', ''):<11}{where:<12}"
+        if "skipped" in result:
+            print(f"{label}skipped: {result['skipped']}")
+        else:
+            print(
+                f"{label}median {result['median_ms']:9.2f} ms   p95 {result['p95_ms']:9.2f} ms"
+            )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
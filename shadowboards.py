@@ -1,38 +1,97 @@
+import time
+
+STARTUP_STARTED = time.perf_counter()
+
+import sys
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog
 from PIL import Image, ImageTk
-import cv2
-import numpy as np
-import subprocess
 import os
-import re
-import tempfile
-from picamera2 import Picamera2
-import RPi.GPIO as GPIO
-import time
-import webbrowser
-import xml.etree.ElementTree as ET
-import utils.barrel as barrel
-
 
-# Initialize the camera
-picam2 = Picamera2()
-
-# Set the camera resolution to ensure consistent frame sizes
-picam2.configure(picam2.create_still_configuration(main={"size": (640, 480)}))
-
-# GPIO setup
-GPIO.setmode(GPIO.BCM)
+# Use the stand-in camera and GPIO backends off the Pi
+if os.environ.get("SHADOWBOARDS_FAKE_HARDWARE"):
+    import utils.fake_hardware as fake_hardware
+
+    fake_hardware.install()
+
+from utils.buttons import ButtonMonitor
+from utils.job_queue import JobQueue
+from utils.metrics import MetricsLog, StageTimer
+from utils.persist import WriteBehind
+
+# The camera, GPIO, OpenCV and the capture pipeline are loaded by
+# init_hardware() on a background thread once the home screen is up
+GPIO = None
+cv2 = None
+pipeline = None
+burst = None
+camera = None  # utils.camera_daemon.CameraDaemon, once it has frames
+button_monitor = None
+preview_renderer = None
+modules_loaded = threading.Event()  # OpenCV and the pipeline can be used
+hardware_ready = threading.Event()  # The camera and buttons are set up
+hardware_error = None
+
+# Run with --profile-startup to print how long each startup step took
+PROFILE_STARTUP = "--profile-startup" in sys.argv
+startup_timer = StageTimer()  # Import and init steps on the loader thread
+startup_marks = {}  # Milestone -> ms since launch
+
+
+# Function to record when a startup milestone was reached
+def mark_startup(milestone):
+    startup_marks[milestone] = (time.perf_counter() - STARTUP_STARTED) * 1000
+
+
+mark_startup("gui_imports")
+
+# Live preview settings: the feed comes from the low-res stream and is
+# capped at PREVIEW_FPS so it doesn't compete with capture processing
+PREVIEW_SIZE = (320, 240)
+PREVIEW_FPS = 15
+CANVAS_SIZE = (640, 480)  # The crop zone is drawn in these coordinates
+last_preview_seq = -1  # Sequence number of the frame on the canvas
+
+# Draw the outlines a capture would trace over the live preview, so a bad
+# threshold or crop shows before the capture is taken
+SHOW_OUTLINE_OVERLAY = False
+outline_overlay = None  # preview.OutlineOverlay, set by init_hardware()
+
+# The camera runs in its own process (see utils/camera_daemon.py) at this
+# frame rate and shares its frames with the GUI through shared memory
+CAMERA_FPS = 30
+
+# Capture full-resolution stills instead of reading the 640x480 main stream.
+# The camera switches to a still mode only for the capture, and only the crop
+# zone of the still is undistorted, thresholded and traced. STILL_SIZE of
+# None means the full sensor.
+HIGH_RES_STILLS = False
+STILL_SIZE = None
+capture_size = CANVAS_SIZE  # Resolution captures are processed at
+
+# Take BURST_FRAMES frames back to back for each capture and combine them
+# pixel by pixel with BURST_METHOD ("median" or "mean") before tracing, to
+# even out sensor noise and flicker. 1 captures a single frame.
+BURST_FRAMES = 1
+BURST_METHOD = "median"
+burst_stacks = None  # burst.StackPool, set by init_hardware()
+
+# Capture without a button press once a tool is in the crop zone and the
+# scene has been still for AUTO_CAPTURE_STABLE_MS, judged from the preview
+AUTO_CAPTURE = False
+AUTO_CAPTURE_STABLE_MS = 800
+auto_capture = None  # auto_capture.AutoCapture, set by init_hardware()
 
 # Define the GPIO pin numbers where the buttons are connected
 red_button_pin = 17
 blue_button_pin = 27
 green_button_pin = 22
 
-# Set up the button pins as inputs with pull-up resistors
-GPIO.setup(red_button_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(blue_button_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(green_button_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+# Buttons that also report a double press. A double press is only told apart
+# from a single one after a short wait, so leave this empty unless needed.
+DOUBLE_PRESS_BUTTONS = ()
+BUTTON_POLL_MS = 20  # How often the GUI picks up queued button events
 
 # Global variables
 running = True
@@ -42,14 +101,51 @@ output_directory = ""
 run_title = ""
 directory_dialog_open = False
 gpio_monitor_task = None
-PIXELS_PER_CM = 24.16
-
-# Barrel Distortion Variables (calculated with barrel.py)
-ret = barrel.ret
-mtx = barrel.mtx
-dist = barrel.dist
-rvecs = barrel.rvecs
-tvecs = barrel.tvecs
+PIXELS_PER_CM = 24.16  # Same default as utils/pipeline.py
+session_id = 0  # Changes on every new run so stale jobs are ignored
+capture_queue_task = None
+running_sheet = None
+metrics_log = None
+session_manifest = None  # Index of the output directory's captures
+
+# Append each capture to the combined sheet as soon as it is processed
+RUNNING_COMBINE = True
+
+# Format to archive captured photos in ("jpg", "png" or None to skip), and
+# whether to keep the uncropped frame as well as the cropped photo
+PHOTO_ARCHIVE_FORMAT = "jpg"
+ARCHIVE_RAW_PHOTOS = False
+
+# Set to the foam stock size in cm, e.g. (60, 40), to nest the parts onto
+# sheets of that size instead of stacking them in one tall sheet
+SHEET_SIZE_CM = None
+SHEET_MARGIN_CM = 0.5
+ALLOW_ROTATION = True
+SHEET_WRITERS = 4  # Sheets written at once
+
+# Outlines are simplified so no point moves more than this many mm (0 = off)
+SIMPLIFY_TOLERANCE_MM = 0.25
+
+# Reuse traces of outlines that were traced before, e.g. a tool shot again
+USE_TRACE_CACHE = True
+trace_cache = None  # Set by init_hardware()
+
+# Also write each outline and the combined sheet(s) as DXF, in mm
+EXPORT_DXF = True
+
+# Captures are processed in the background so the feed and buttons stay live
+MAX_PENDING_CAPTURES = 4
+CAPTURE_WORKERS = 2
+capture_queue = JobQueue(max_pending=MAX_PENDING_CAPTURES, workers=CAPTURE_WORKERS)
+
+# Photos and SVGs are staged in RAM and written to the SD card in the
+# background, each file replaced atomically
+MAX_WRITE_BACKLOG = 32
+file_writer = WriteBehind(max_backlog=MAX_WRITE_BACKLOG)
+
+# Barrel Distortion Variables (see barrel.py), set by init_hardware()
+ret = mtx = dist = rvecs = tvecs = None
+calibration_size = None  # Resolution mtx was calibrated at
 
 # Variables for crop zone selection
 start_x = None
@@ -60,6 +156,144 @@ crop_selected = False
 rectangle_coords = None  # Store rectangle coordinates separately
 
 
+# Function to import the capture modules and set up the buttons and camera.
+# Runs on a background thread so the home screen is usable straight away;
+# it must not touch any Tk widgets.
+def init_hardware():
+    global GPIO, cv2, pipeline, burst, camera, button_monitor, preview_renderer
+    global ret, mtx, dist, rvecs, tvecs, hardware_error
+    global calibration_size, capture_size, trace_cache, burst_stacks, auto_capture
+    global outline_overlay
+
+    camera_process = None
+    try:
+        # Start the camera process first, it opens the camera while the rest
+        # is loaded here
+        with startup_timer.stage("start_camera"):
+            from utils.camera_daemon import CameraDaemon
+
+            camera_process = CameraDaemon(
+                CANVAS_SIZE,
+                PREVIEW_SIZE,
+                HIGH_RES_STILLS,
+                STILL_SIZE,
+                CAMERA_FPS,
+                burst=BURST_FRAMES,
+            ).start()
+
+        # Buttons first, they are the quickest way to interact with the kiosk
+        with startup_timer.stage("import_gpio"):
+            import RPi.GPIO as GPIO
+        with startup_timer.stage("init_gpio"):
+            GPIO.setmode(GPIO.BCM)
+            # Set up the button pins as inputs with pull-up resistors,
+            # reported through edge-detection callbacks instead of being polled
+            button_monitor = ButtonMonitor(
+                GPIO,
+                {
+                    "red": red_button_pin,
+                    "blue": blue_button_pin,
+                    "green": green_button_pin,
+                },
+                long_press_buttons=("green",),
+                double_press_buttons=DOUBLE_PRESS_BUTTONS,
+            )
+
+        with startup_timer.stage("import_cv2"):
+            import cv2
+        with startup_timer.stage("import_pipeline"):
+            import utils.barrel as barrel
+            import utils.burst as burst
+            import utils.pipeline as pipeline
+            import utils.undistort as undistort
+            from utils.auto_capture import AutoCapture
+            from utils.preview import OutlineOverlay, PreviewRenderer
+            from utils.trace_cache import TraceCache
+
+        with startup_timer.stage("init_camera"):
+            # Wait for the camera process's first frames. The main stream is
+            # only read on a capture event, the lores stream feeds the preview.
+            camera_process.wait_ready()
+            capture_size = camera_process.capture_size
+            camera = camera_process
+
+        # One burst stack per capture that can be queued, so a burst never
+        # waits for a stack
+        if BURST_FRAMES > 1:
+            burst_stacks = burst.StackPool(
+                BURST_FRAMES,
+                camera.rings["still" if HIGH_RES_STILLS else "main"].shape,
+                MAX_PENDING_CAPTURES,
+            )
+
+        # Use the calibration file from utils/calibrate.py if there is one
+        lens = barrel.load_calibration()
+        print(f"Lens calibration: {lens['path'] or 'built-in defaults'}")
+        mtx, dist, calibration_size = lens["mtx"], lens["dist"], lens["image_size"]
+        ret, rvecs, tvecs = barrel.ret, barrel.rvecs, barrel.tvecs
+        preview_renderer = PreviewRenderer(PREVIEW_SIZE, CANVAS_SIZE)
+        if SHOW_OUTLINE_OVERLAY:
+            outline_overlay = OutlineOverlay(CANVAS_SIZE, PREVIEW_FPS)
+        if AUTO_CAPTURE:
+            auto_capture = AutoCapture(AUTO_CAPTURE_STABLE_MS)
+        if USE_TRACE_CACHE:
+            trace_cache = TraceCache()
+
+        # Build (or load) the undistortion remap tables for the capture
+        # resolution now so the first capture doesn't pay for them
+        with startup_timer.stage("undistort_maps"):
+            if tuple(calibration_size) != capture_size:
+                undistort.get_undistort_maps(
+                    undistort.scale_camera_matrix(mtx, calibration_size, capture_size),
+                    dist,
+                    capture_size,
+                )
+            else:
+                undistort.get_undistort_maps(mtx, dist, capture_size)
+        modules_loaded.set()
+
+        # Only needed when a run starts or is combined, but load them while idle
+        with startup_timer.stage("import_combine"):
+            import utils.combine
+            import utils.layout
+    except Exception as e:
+        print(f"Hardware initialization failed: {e}")
+        hardware_error = e
+        if camera_process is not None and camera is None:
+            camera_process.close()
+    finally:
+        hardware_ready.set()
+
+
+# Function to start the camera feed once init_hardware() has finished
+def wait_for_hardware():
+    if not hardware_ready.is_set():
+        root.after(20, wait_for_hardware)
+        return
+
+    mark_startup("hardware_ready")
+    if hardware_error is not None or camera is None:
+        messagebox.showerror(
+            "Error", f"The camera could not be started: {hardware_error}"
+        )
+    else:
+        update_camera_feed()
+        mark_startup("first_frame")
+
+    if PROFILE_STARTUP:
+        print_startup_profile()
+
+
+# Function to print the startup profile
+def print_startup_profile():
+    print(f"{'startup step':<24}{'ms':>10}")
+    for step, ms in startup_timer.stages.items():
+        print(f"{step:<24}{ms:>10.1f}")
+    print(f"{'milestone':<24}{'ms since launch':>18}")
+    for milestone, ms in startup_marks.items():
+        print(f"{milestone:<24}{ms:>18.1f}")
+
+
 # Function to switch to the main app screen
 def go_to_app():
     home_frame.pack_forget()
@@ -72,13 +306,111 @@ def go_to_app():
 
 # Function to allow the user to open the docs
 def open_docs():
+    import webbrowser
+
     webbrowser.open("https://youtu.be/l79OpbDlW8Q")
 
 
-# Function to capture image and convert to SVG
-def capture_and_convert_to_svg():
-    global image_count, output_directory, PIXELS_PER_CM
+# Function run on a worker thread to turn a captured frame into an SVG
+def process_capture(
+    frame,
+    frame_seqs,
+    photo_base_path,
+    svg_path,
+    dxf_path,
+    crop,
+    pixels_per_cm,
+    timer,
+    log,
+    manifest,
+    capture_number,
+    submitted,
+):
+    # Time spent waiting in the queue for a free worker
+    timer.stages["queue_wait"] = (time.perf_counter() - submitted) * 1000
+
+    # Combine a burst into one frame and hand its stack back for the next one
+    if frame.ndim == 4:
+        stack = frame
+        try:
+            with timer.stage("stack"):
+                frame = burst.stack_frames(stack, BURST_METHOD)
+        finally:
+            burst_stacks.release(stack)
+
+    # Optionally archive the frame as captured, before any processing
+    if ARCHIVE_RAW_PHOTOS:
+        with timer.stage("archive"):
+            pipeline.save_photo(
+                frame, f"{photo_base_path}_raw", PHOTO_ARCHIVE_FORMAT, file_writer
+            )
+
+    # Undistort, crop and trace the frame into a sized SVG
+    image, svg_info = pipeline.process_image(
+        frame,
+        svg_path,
+        mtx,
+        dist,
+        crop,
+        pixels_per_cm,
+        file_writer,
+        timer,
+        calibration_size,
+        SIMPLIFY_TOLERANCE_MM,
+        trace_cache,
+        dxf_path=dxf_path,
+    )
+
+    svg_info["id"] = capture_number
+
+    # Optionally archive the cropped image
+    with timer.stage("archive"):
+        photo_path = pipeline.save_photo(
+            image, photo_base_path, PHOTO_ARCHIVE_FORMAT, file_writer
+        )
+
+    # Prepare the thumbnail here; the PhotoImage is made on the Tk thread
+    with timer.stage("thumbnail"):
+        thumbnail = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        svg_info["thumbnail"] = thumbnail.resize((200, 200))
+
+    # Record the stage timings in the run's metrics log
+    if log is not None:
+        log.append(
+            {
+                "type": "capture",
+                "capture": capture_number,
+                "frame_seqs": frame_seqs,
+                "width_px": svg_info["width_px"],
+                "height_px": svg_info["height_px"],
+                "nodes": svg_info["nodes"],
+                "trace_cached": svg_info["trace_cached"],
+                "total_ms": timer.total_ms(),
+                "stages": timer.stages,
+            }
+        )
+
+    # Index the capture so the session can be resumed without a rescan
+    manifest.record_capture(
+        capture_number,
+        svg_info,
+        photo_path,
+        crop=list(crop),
+        capture_size=list(frame.shape[1::-1]),
+        pixels_per_cm=pixels_per_cm,
+        calibration={
+            "image_size": list(calibration_size),
+            "mtx": mtx.tolist(),
+            "dist": dist.tolist(),
+        },
+        nodes=svg_info["nodes"],
+        stages=timer.stages,
+    )
+    return svg_info
+
 
+# Function to capture image and queue it for conversion to SVG
+def capture_and_convert_to_svg():
     if not output_directory:
         messagebox.showerror("Error", "Please select an output directory first.")
         return
@@ -87,113 +419,157 @@ def capture_and_convert_to_svg():
         messagebox.showerror("Error", "Please finalize the crop zone first.")
         return
 
-    # Ensure the output directory has folders for photos and SVGs
-    photos_dir = os.path.join(output_directory, "photos")
-    svgs_dir = os.path.join(output_directory, "svgs")
-    os.makedirs(photos_dir, exist_ok=True)
-    os.makedirs(svgs_dir, exist_ok=True)
+    # A capture now would go to the folder that is being replaced
+    if directory_dialog_open:
+        root.bell()
+        update_queue_status("Choose the folder first")
+        return
 
-    # Capture and process the image
-    image_count += 1
-    image_path = os.path.join(photos_dir, f"captured_image_{image_count}.jpg")
-    svg_path = os.path.join(svgs_dir, f"output_image_{image_count}.svg")
-
-    # Capture image from camera
-    picam2.capture_file(image_path)
-
-    # Load the captured image
-    image = cv2.imread(image_path)
-
-    h, w = image.shape[:2]
-    newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (w, h), 1, (w, h))
-
-    # undistort
-    dst = cv2.undistort(image, mtx, dist, None, newcameramtx)
-
-    # crop the image
-    x, y, w, h = roi
-    image = dst[y : y + h, x : x + w]
-
-    # If crop zone is selected, crop the image
-    if crop_selected and crop_coords:
-        x0, y0, x1, y1 = map(int, crop_coords)
-        # Ensure coordinates are within the image dimensions
-        x0 = max(0, min(x0, image.shape[1]))
-        x1 = max(0, min(x1, image.shape[1]))
-        y0 = max(0, min(y0, image.shape[0]))
-        y1 = max(0, min(y1, image.shape[0]))
-        image = image[y0:y1, x0:x1]
-        # Save the cropped image back to image_path
-        cv2.imwrite(image_path, image)
-
-    # Load the last captured image and display it on the label
-    last_img = Image.open(image_path)
-    last_img = last_img.resize((200, 200))
-    last_imgtk = ImageTk.PhotoImage(last_img)
-
-    lbl_last_photo.imgtk = last_imgtk  # Keep a reference to avoid garbage collection
-    lbl_last_photo.configure(image=last_imgtk)
+    if hardware_error is not None:
+        messagebox.showerror(
+            "Error", f"The camera could not be started: {hardware_error}"
+        )
+        return
 
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if camera is None or not modules_loaded.is_set():
+        root.bell()
+        update_queue_status("The camera is still starting")
+        return
 
-    # Apply a binary threshold to separate the object from the background
-    _, binary = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY_INV)
+    # Reject the press visibly if the background queue is already full
+    if capture_queue.pending >= capture_queue.max_pending:
+        root.bell()
+        update_queue_status(
+            f"Queue full, capture rejected ({capture_queue.pending} pending)"
+        )
+        return
 
-    # Find contours of the object
-    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Ensure the output directory has folders for photos, SVGs and DXFs
+    photos_dir = os.path.join(output_directory, "photos")
+    svgs_dir = os.path.join(output_directory, "svgs")
+    dxfs_dir = os.path.join(output_directory, "dxfs")
+    os.makedirs(photos_dir, exist_ok=True)
+    os.makedirs(svgs_dir, exist_ok=True)
+    if EXPORT_DXF:
+        os.makedirs(dxfs_dir, exist_ok=True)
+
+    # Capture and process the image. Files are numbered by the session
+    # manifest, which never hands out a number twice.
+    capture_id = session_manifest.new_id()
+    photo_base_path = os.path.join(photos_dir, f"captured_image_{capture_id}")
+    svg_path = os.path.join(svgs_dir, f"output_image_{capture_id}.svg")
+    dxf_path = (
+        os.path.join(dxfs_dir, f"output_image_{capture_id}.dxf") if EXPORT_DXF else None
+    )
 
-    # Create a mask for the object outline
-    mask = np.zeros_like(gray)
-    cv2.drawContours(mask, contours, -1, (255), thickness=2)
+    # Copy the latest frame, or the next BURST_FRAMES frames into a stack,
+    # out of the camera process's shared memory
+    timer = StageTimer()
+    with timer.stage("camera_grab"):
+        if BURST_FRAMES > 1:
+            frame = burst_stacks.acquire()
+            try:
+                if HIGH_RES_STILLS:
+                    frame_seqs = camera.capture_stills(frame)
+                else:
+                    frame_seqs = camera.capture_burst(frame)
+            except Exception:
+                burst_stacks.release(frame)
+                raise
+        elif HIGH_RES_STILLS:
+            frame_seq, frame = camera.capture_still()
+            frame_seqs = [frame_seq]
+        else:
+            frame_seq, frame = camera.capture("main")
+            frame_seqs = [frame_seq]
+
+    # Map the crop zone from the canvas onto the captured frame
+    crop = pipeline.scale_crop(crop_coords, CANVAS_SIZE, capture_size)
+
+    # Hand the rest of the pipeline to the background workers
+    capture_queue.submit(
+        session_id,
+        process_capture,
+        frame,
+        frame_seqs,
+        photo_base_path,
+        svg_path,
+        dxf_path,
+        crop,
+        capture_pixels_per_cm(),
+        timer,
+        metrics_log,
+        session_manifest,
+        capture_id,
+        time.perf_counter(),
+    )
+    update_queue_status()
 
-    # Invert the mask to have the outline as black on white
-    mask_inv = cv2.bitwise_not(mask)
 
-    # Save the mask to a temporary PGM file
-    with tempfile.NamedTemporaryFile(suffix=".pgm", delete=True) as temp_pgm:
-        cv2.imwrite(temp_pgm.name, mask_inv)
+# Function to get the scale of captured frames, which is PIXELS_PER_CM at
+# the canvas resolution
+def capture_pixels_per_cm():
+    return PIXELS_PER_CM * capture_size[0] / CANVAS_SIZE[0]
 
-        # Run potrace using the temporary PGM file
-        subprocess.run(["potrace", "-s", "-o", svg_path, temp_pgm.name])
 
-    # Compute the width and height in pixels
-    height_px, width_px = image.shape[:2]
+# Function to show the background queue counts, with an optional warning
+def update_queue_status(warning=None):
+    if warning:
+        lbl_queue_status.config(text=warning, fg="red")
+    else:
+        lbl_queue_status.config(
+            text=f"Pending: {capture_queue.pending}  Completed: {capture_queue.completed}",
+            fg="black",
+        )
 
-    # Compute the width and height in centimeters
-    pixels_per_cm = PIXELS_PER_CM  # Your calculated value
-    width_cm = width_px / pixels_per_cm
-    height_cm = height_px / pixels_per_cm
 
-    # Modify the SVG file to include the correct dimensions
-    import xml.etree.ElementTree as ET
+# Function to show a finished capture and add it to the combine set
+def add_capture_result(svg_info):
+    global image_count
 
-    # Parse the SVG file
-    tree = ET.parse(svg_path)
-    root_svg = tree.getroot()
+    # Display the last processed image on the label
+    last_imgtk = ImageTk.PhotoImage(svg_info["thumbnail"])
+    lbl_last_photo.imgtk = last_imgtk  # Keep a reference to avoid GC
+    lbl_last_photo.configure(image=last_imgtk)
 
-    # Define the SVG namespace
-    svg_ns = {"svg": "http://www.w3.org/2000/svg"}
+    # Add the SVG and its size to the list for combining later
+    del svg_info["thumbnail"]
+    svg_files.append(svg_info)
+    image_count += 1
 
-    # Remove existing width, height, and viewBox attributes
-    for attr in ["width", "height", "viewBox"]:
-        if attr in root_svg.attrib:
-            del root_svg.attrib[attr]
+    # Grow the running combined sheet so "Combine" only has to wrap it
+    # The SVG may still be staged in RAM, waiting to be written
+    if running_sheet is not None:
+        running_sheet.append(svg_info, file_writer.read(svg_info["svg_path"]))
 
-    # Set new width, height, and viewBox attributes
-    root_svg.set("width", f"{width_cm}cm")
-    root_svg.set("height", f"{height_cm}cm")
-    root_svg.set("viewBox", f"0 0 {width_px} {height_px}")
-    print(width_cm)
-    print(height_cm)
+    lbl_pics_taken.config(text=f"Photos Processed: {image_count}")
+    update_queue_status()
 
-    # Write the modified SVG back to file
-    tree.write(svg_path)
 
-    # Add the SVG path to the list for combining later
-    svg_files.append(svg_path)
+# Function to collect finished captures on the Tk thread. One bad result is
+# reported and skipped; the polling itself always carries on.
+def poll_capture_queue():
+    global capture_queue_task
 
-    lbl_pics_taken.config(text=f"Photos Processed: {image_count}")
+    try:
+        for job_session, svg_info, error in capture_queue.poll():
+            if error is not None:
+                print(f"Capture processing failed: {error}")
+                update_queue_status(f"Capture failed: {error}")
+                continue
+
+            # Ignore captures that belong to a previous run
+            if job_session != session_id:
+                continue
+
+            try:
+                add_capture_result(svg_info)
+            except Exception as e:
+                print(f"Capture result could not be added: {e}")
+                update_queue_status(f"Capture failed: {e}")
+    finally:
+        if running:
+            capture_queue_task = root.after(50, poll_capture_queue)
 
 
 # Function to combine all SVGs into a single file
@@ -204,103 +580,137 @@ def combine_svgs():
         messagebox.showerror("Error", "No SVG files to combine.")
         return
 
-    combined_svg_path = os.path.join(output_directory, "combined_output.svg")
-
-    individual_svgs = []
-
-    # Pixels per cm
-    pixels_per_cm = PIXELS_PER_CM  # Your calculated value
-
-    # Variables to calculate total width and height in pixels
-    max_width_px = 0
-    total_height_px = 0
-
-    from lxml import etree
-
-    # Parse all SVGs to extract their width, height, and content
-    for svg_file in svg_files:
-        # Parse the SVG file using lxml
-        parser = etree.XMLParser(ns_clean=True, recover=True)
-        tree = etree.parse(svg_file, parser)
-        root_svg = tree.getroot()
-
-        # Extract width and height from the SVG root element
-        width_cm = float(root_svg.get("width").replace("cm", ""))
-        height_cm = float(root_svg.get("height").replace("cm", ""))
-
-        # Corrected calculations: Multiply instead of divide
-        width_px = width_cm * pixels_per_cm
-        height_px = height_cm * pixels_per_cm
-
-        # Update total dimensions
-        max_width_px = max(max_width_px, width_px)
-        total_height_px += height_px
-
-        # Remove namespace prefixes for simplicity
-        for elem in root_svg.iter():
-            if not hasattr(elem.tag, "find"):
-                continue  # It's a comment or similar
-            i = elem.tag.find("}")
-            if i >= 0:
-                elem.tag = elem.tag[i + 1 :]
+    if captures_in_flight():
+        return
 
-        # Extract the inner content of the SVG (excluding the outer <svg> tag)
-        svg_inner = list(root_svg)
+    # Loaded in the background at startup, so normally already imported
+    import utils.combine as combine
+    import utils.dxf as dxf
+    import utils.layout as layout
 
-        individual_svgs.append(
-            {"width_px": width_px, "height_px": height_px, "content": svg_inner}
+    combined_svg_path = os.path.join(output_directory, "combined_output.svg")
+    combined_dxf_path = os.path.join(output_directory, "combined_output.dxf")
+
+    # Parts captured before DXF export was turned on have no DXF to combine
+    export_dxf = EXPORT_DXF and all("dxf_path" in svg_info for svg_info in svg_files)
+
+    timer = StageTimer()
+    record = {"type": "combine", "parts": len(svg_files)}
+
+    # Make sure every SVG has been written before reading them back
+    with timer.stage("flush"):
+        file_writer.flush()
+
+    if SHEET_SIZE_CM:
+        # Nest the parts onto sheets of the configured size, each sheet
+        # written as its own file, several at once
+        with timer.stage("layout"):
+            sheet_paths, sheets = combine.layout_svgs(
+                svg_files,
+                combined_svg_path,
+                SHEET_SIZE_CM,
+                capture_pixels_per_cm(),
+                SHEET_MARGIN_CM,
+                ALLOW_ROTATION,
+                SHEET_WRITERS,
+            )
+        extra_paths = {}
+        if export_dxf:
+            # Same placements as the SVG sheets
+            with timer.stage("dxf"):
+                extra_paths["dxf"] = dxf.combine_dxfs(
+                    svg_files,
+                    combined_dxf_path,
+                    capture_pixels_per_cm(),
+                    sheets,
+                    SHEET_WRITERS,
+                )
+
+        # List which parts went onto which sheet
+        with timer.stage("index"):
+            index_path = combine.write_sheet_index(
+                combine.sheet_index_path(combined_svg_path),
+                sheet_paths,
+                sheets,
+                svg_files,
+                capture_pixels_per_cm(),
+                extra_paths,
+            )
+        session_manifest.record_combine(
+            [svg_info["id"] for svg_info in svg_files],
+            sheet_paths + extra_paths.get("dxf", []) + [index_path],
         )
+        utilization = layout.total_utilization(sheets)
+        record.update(sheets=len(sheets), utilization=utilization)
+        if metrics_log is not None:
+            metrics_log.append({**record, "stages": timer.stages})
+        messagebox.showinfo(
+            "Success",
+            f"All SVGs nested onto {len(sheets)} sheet(s) ({utilization:.0%} used), "
+            f"listed in {index_path}",
+        )
+    else:
+        # Use the running sheet when it already holds every SVG, otherwise
+        # stream the combined document from the individual files
+        with timer.stage("combine"):
+            if running_sheet is not None and running_sheet.svg_paths == [
+                svg_info["svg_path"] for svg_info in svg_files
+            ]:
+                running_sheet.write()
+            else:
+                combine.combine_svgs(
+                    svg_files, combined_svg_path, capture_pixels_per_cm()
+                )
+        combined_paths = [combined_svg_path]
+        if export_dxf:
+            with timer.stage("dxf"):
+                combined_paths += dxf.combine_dxfs(
+                    svg_files, combined_dxf_path, capture_pixels_per_cm()
+                )
+        session_manifest.record_combine(
+            [svg_info["id"] for svg_info in svg_files], combined_paths
+        )
+        if metrics_log is not None:
+            metrics_log.append({**record, "stages": timer.stages})
 
-    # Compute total dimensions in cm
-    max_width_cm = max_width_px / pixels_per_cm
-    total_height_cm = total_height_px / pixels_per_cm
-
-    # Create the combined SVG root element
-    SVG_NS = "http://www.w3.org/2000/svg"
-    NSMAP = {None: SVG_NS}
-
-    combined_svg = etree.Element("svg", nsmap=NSMAP)
-    combined_svg.set("version", "1.1")
-    combined_svg.set("width", f"{max_width_cm}cm")
-    combined_svg.set("height", f"{total_height_cm}cm")
-    combined_svg.set("viewBox", f"0 0 {max_width_px} {total_height_px}")
-
-    current_y = 0  # Starting Y position in pixels
-
-    for svg_info in individual_svgs:
-        # Create a group element with the appropriate translation
-        g_element = etree.SubElement(combined_svg, "g")
-        g_element.set("transform", f"translate(0, {current_y})")
-
-        # Append the individual SVG content to the group
-        for elem in svg_info["content"]:
-            g_element.append(elem)
-
-        # Update the Y position for the next SVG
-        current_y += svg_info["height_px"]
-
-    # Write the combined SVG to file
-    tree = etree.ElementTree(combined_svg)
-    tree.write(
-        combined_svg_path, encoding="UTF-8", xml_declaration=True, pretty_print=True
-    )
-
-    messagebox.showinfo(
-        "Success", f"All SVGs combined and saved as {combined_svg_path}"
-    )
+        messagebox.showinfo(
+            "Success", f"All SVGs combined and saved as {', '.join(combined_paths)}"
+        )
 
     # Reset for the next set
     global image_count
     image_count = 0
     svg_files = []
+    if running_sheet is not None:
+        running_sheet.reset()
     lbl_pics_taken.config(text=f"Photos Processed: {image_count}")
 
 
+# Function to tell the user, and return True, if captures are still being
+# processed into the current folder
+def captures_in_flight():
+    if not capture_queue.pending:
+        return False
+    messagebox.showerror(
+        "Error",
+        f"{capture_queue.pending} captures are still processing. Try again when they finish.",
+    )
+    return True
+
+
 # Function to select a directory
 def select_directory():
     global output_directory, run_title, image_count, crop_selected, rect_id, crop_coords, rectangle_coords
     global start_x, start_y, end_x, end_y  # Declare as global
+    global running_sheet, metrics_log, session_manifest, svg_files, session_id
+    global directory_dialog_open
 
+    # Captures in flight were numbered by the current manifest and belong in
+    # the current folder, so let them land before switching
+    if captures_in_flight():
+        return
+
+    # Captures and auto-captures wait until the folder dialogs are closed
     directory_dialog_open = True
     directory = filedialog.askdirectory(title="Choose a folder to save your files")
 
@@ -344,18 +754,49 @@ def select_directory():
 
     directory_dialog_open = False
     if directory and run_title:
+        session_id += 1  # Anything still unpolled belongs to the old folder
         output_directory = os.path.join(directory, run_title)
         lbl_selected_dir.config(text=f"Output Directory: {output_directory}")
 
+        # The sheet scale depends on the capture resolution, which is only
+        # known once the camera has started
+        if not hardware_ready.is_set():
+            update_queue_status("Waiting for the camera to start")
+            root.update_idletasks()
+            hardware_ready.wait()
+            update_queue_status()
+
+        # Start a new running combined sheet and metrics log for this directory
+        import utils.combine as combine
+
+        os.makedirs(output_directory, exist_ok=True)
+        metrics_log = MetricsLog(output_directory)
+        running_sheet = (
+            combine.RunningSheet(
+                os.path.join(output_directory, "combined_output.svg"),
+                capture_pixels_per_cm(),
+            )
+            if RUNNING_COMBINE and not SHEET_SIZE_CM
+            else None
+        )
+
         # Ensure the photos and svgs directories exist
         photos_dir = os.path.join(output_directory, "photos")
         os.makedirs(photos_dir, exist_ok=True)
 
-        # Check the existing files in the photos directory and reset image_count accordingly
-        existing_images = [f for f in os.listdir(photos_dir) if f.endswith(".jpg")]
-        image_count = len(
-            existing_images
-        )  # Set the image_count based on existing images
+        # Resume the session from its manifest: the captures that haven't
+        # been combined yet are put back in the combine set. Folders from
+        # before manifests existed are indexed once.
+        import utils.manifest as manifest
+
+        session_manifest = manifest.SessionManifest(output_directory)
+        if not session_manifest.exists():
+            session_manifest.import_existing(capture_pixels_per_cm())
+        svg_files = session_manifest.pending_svg_files()
+        if running_sheet is not None:
+            for svg_info in svg_files:
+                running_sheet.append(svg_info)
+        image_count = len(svg_files)
 
         # Update the label for Photos Processed after selecting the directory
         lbl_pics_taken.config(text=f"Photos Processed: {image_count}")
@@ -454,6 +895,8 @@ def finalize_crop_zone(event=None):
     global crop_selected, rect_id
     if crop_coords:
         crop_selected = True
+        if auto_capture is not None:
+            auto_capture.reset()  # Judge the new zone from scratch
         messagebox.showinfo("Crop Zone Finalized", "Crop zone has been finalized.")
         # Optionally, remove the rectangle since the live feed will now show only the cropped area.
         if rect_id:
@@ -502,104 +945,111 @@ def finish_crop(event):
 
 # Function to update the live camera feed in the GUI
 def update_camera_feed():
-    frame = picam2.capture_array()  # Capture a frame from the camera
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # Convert the frame to RGB
-
-    # If crop zone is selected, crop the frame
-    if crop_selected and crop_coords:
-        x0, y0, x1, y1 = map(int, crop_coords)
-        # Ensure coordinates are within the frame dimensions
-        x0 = max(0, min(x0, frame.shape[1]))
-        x1 = max(0, min(x1, frame.shape[1]))
-        y0 = max(0, min(y0, frame.shape[0]))
-        y1 = max(0, min(y1, frame.shape[0]))
-        frame = frame[y0:y1, x0:x1]
-        # Resize the frame to fit the canvas
-        frame = cv2.resize(frame, (640, 480), interpolation=cv2.INTER_AREA)
-    else:
-        # Resize the frame to fit the canvas
-        frame = cv2.resize(frame, (640, 480), interpolation=cv2.INTER_AREA)
-
-    img = Image.fromarray(frame)  # Convert frame to a PIL image
-    imgtk = ImageTk.PhotoImage(image=img)  # Convert PIL image to ImageTk format
-
-    # Remove the previous image
-    lbl_camera.delete("live_image")
-
-    # Display the image
-    lbl_camera.imgtk = imgtk
-    image_id = lbl_camera.create_image(
-        0, 0, anchor=tk.NW, image=imgtk, tag="live_image"
-    )
-
-    # Lower the image so that rectangle is above it
-    lbl_camera.tag_lower(image_id)
-
-    lbl_camera.after(10, update_camera_feed)  # Update the camera feed every 10 ms
-
-
-# Function to monitor button presses
+    global last_preview_seq
+    started = time.monotonic()
+
+    # The latest low-res frame, read in place from shared memory
+    seq, frame = camera.latest("lores")
+    if frame is not None and seq != last_preview_seq:
+        if auto_capture is not None and crop_selected:
+            check_auto_capture(frame)
+
+        # Convert, crop and resize into the preview renderer's reused buffers
+        crop = crop_coords if crop_selected and crop_coords else None
+        canvas_frame = preview_renderer.render(frame, crop)
+
+        # Outline what a capture would trace, skipping frames if need be
+        if outline_overlay is not None:
+            outline_overlay.update(preview_renderer.luma(frame, crop))
+            outline_overlay.draw(canvas_frame)
+
+        # Skip the frame if the camera wrote over it while it was rendered,
+        # otherwise update the persistent image in place
+        if camera.is_current("lores", seq):
+            preview_imgtk.paste(Image.fromarray(canvas_frame))
+            last_preview_seq = seq
+
+    # Schedule the next frame so the preview runs at most PREVIEW_FPS
+    elapsed_ms = (time.monotonic() - started) * 1000
+    if outline_overlay is not None:
+        outline_overlay.adapt(elapsed_ms)
+    lbl_camera.after(max(1, int(1000 / PREVIEW_FPS - elapsed_ms)), update_camera_feed)
+
+
+# Function to take a capture if the auto-capture says the scene is ready
+def check_auto_capture(frame):
+    ready = auto_capture.update(preview_renderer.luma(frame, crop_coords))
+    if (
+        ready
+        and output_directory
+        and not directory_dialog_open
+        and main_frame.winfo_ismapped()
+        and capture_queue.pending < capture_queue.max_pending
+    ):
+        capture_and_convert_to_svg()
+        auto_capture.captured()
+
+
+# Function to act on one button gesture
+def handle_button(name, gesture):
+    # Detect if we're on the home screen or in the app
+    if home_frame.winfo_ismapped():  # If home screen is visible
+        if name == "red":
+            quit_program()  # Quit the app (mapped to the red button)
+        elif name == "blue":
+            go_to_app()  # Start the app (mapped to the blue button)
+        elif name == "green":
+            open_docs()  # Open the docs (mapped to the green button)
+
+    elif main_frame.winfo_ismapped():  # If the main app screen is visible
+        if name == "red":
+            quit_program()  # Quit the app (mapped to the red button)
+        elif name == "blue":
+            capture_and_convert_to_svg()  # Capture photo (mapped to the blue button)
+        elif name == "green" and directory_dialog_open:
+            root.event_generate("<Return>")  # Simulate Enter key to close the dialog
+        elif name == "green" and gesture == "long":
+            if crop_selected:
+                handle_crop_button()  # Hold green to change the crop zone
+            else:
+                finalize_crop_zone()
+        elif name == "green":
+            if not crop_selected:
+                finalize_crop_zone()  # Finalize crop zone (mapped to the green button)
+            else:
+                combine_svgs()  # Combine SVGs
+
+
+# Function to handle button presses queued by the GPIO callbacks
 def monitor_gpio():
     global gpio_monitor_task
 
     if not running:
         return  # Stop further GPIO monitoring if the program is quitting
 
-    try:
-        # Detect if we're on the home screen or in the app
-        if home_frame.winfo_ismapped():  # If home screen is visible
-            # Home screen actions
-            if GPIO.input(red_button_pin) == GPIO.LOW:
-                quit_program()  # Quit the app (mapped to the red button)
-                time.sleep(0.2)  # Debounce delay
-
-            if GPIO.input(blue_button_pin) == GPIO.LOW:
-                go_to_app()  # Start the app (mapped to the blue button)
-                time.sleep(0.2)  # Debounce delay
-
-            if GPIO.input(green_button_pin) == GPIO.LOW:
-                open_docs()  # Open the docs (mapped to the green button)
-                time.sleep(0.2)  # Debounce delay
-
-        elif main_frame.winfo_ismapped():  # If the main app screen is visible
-            # App screen actions
-            if GPIO.input(red_button_pin) == GPIO.LOW:
-                quit_program()  # Quit the app (mapped to the red button)
-                time.sleep(0.2)  # Debounce delay
-
-            if GPIO.input(blue_button_pin) == GPIO.LOW:
-                capture_and_convert_to_svg()  # Capture photo (mapped to the blue button)
-                time.sleep(0.2)  # Debounce delay
-
-            if GPIO.input(green_button_pin) == GPIO.LOW:
-                if not crop_selected:
-                    finalize_crop_zone()  # Finalize crop zone (mapped to the green button)
-                else:
-                    combine_svgs()  # Combine SVGs
-                time.sleep(0.2)  # Debounce delay
-
-            if (
-                directory_dialog_open
-            ):  # Custom flag to check if directory dialog is open
-                if GPIO.input(green_button_pin) == GPIO.LOW:
-                    root.event_generate(
-                        "<Return>"
-                    )  # Simulate Enter key to close the dialog
-                    time.sleep(0.2)
-
-    except RuntimeError as e:
-        print(f"RuntimeError in monitor_gpio: {e}")
-        return  # Exit the function to prevent further errors
+    events = button_monitor.poll() if button_monitor is not None else []
+    for name, gesture in events:
+        try:
+            handle_button(name, gesture)
+        except RuntimeError as e:
+            print(f"RuntimeError in monitor_gpio: {e}")
+        if not running:
+            return
 
-    if running:
-        gpio_monitor_task = root.after(100, monitor_gpio)
+    gpio_monitor_task = root.after(BUTTON_POLL_MS, monitor_gpio)
 
 
 # Function to restart for a new process
 def start_another_process():
     global running, image_count, svg_files, output_directory, run_title, crop_selected, rect_id, rectangle_coords
+    global session_id
+
+    if captures_in_flight():
+        return
+
     # Reset global variables
     running = True
+    session_id += 1  # Results still in the queue belong to the previous run
     image_count = 0  # Reset image count to 0
     svg_files = []
     output_directory = ""
@@ -619,7 +1069,9 @@ def start_another_process():
 
 
 def quit_program():
-    global running, gpio_monitor_task
+    global running, gpio_monitor_task, capture_queue_task
+    if not running:
+        return  # Already quitting, e.g. the red button and Quit both pressed
     running = False  # Stop the GPIO monitoring loop
 
     if gpio_monitor_task is not None:
@@ -628,6 +1080,36 @@ def quit_program():
         )  # Cancel the scheduled GPIO monitoring task
         gpio_monitor_task = None  # Reset the task handle to avoid future issues
 
+    if capture_queue_task is not None:
+        root.after_cancel(capture_queue_task)
+        capture_queue_task = None
+
+    if button_monitor is not None:
+        button_monitor.close()
+
+    # Let captures that are already queued finish, then flush their files
+    capture_queue.shutdown(wait=True)
+    file_writer.close()
+
+    # Stop the camera process, reporting how many frames were dropped
+    if camera is not None:
+        stats = camera.stats()
+        camera.close()
+        print(
+            f"Camera: {stats['lores']['seq'] + 1} frames, "
+            f"{stats['lores']['dropped']} dropped, "
+            f"{stats['lores']['skipped']} not shown in the preview"
+        )
+        if metrics_log is not None:
+            metrics_log.append({"type": "camera", "streams": stats})
+
+    # Report how long each stage took during this run
+    if metrics_log is not None:
+        metrics_log.write_summary()
+    if trace_cache is not None:
+        stats = trace_cache.stats()
+        print(f"Trace cache: {stats['hits']} hits, {stats['misses']} misses")
+
     root.quit()  # Quit the Tkinter application
 
 
@@ -757,6 +1239,15 @@ lbl_pics_taken = tk.Label(
 )
 lbl_pics_taken.grid(row=4, column=0, padx=0, pady=0)
 
+# Display a label for the background processing queue
+lbl_queue_status = tk.Label(
+    main_frame,
+    text="Pending: 0  Completed: 0",
+    font=("Arial", 12),
+    bg="#B5C689",
+)
+lbl_queue_status.grid(row=5, column=0, padx=0, pady=0)
+
 # Display a label for the currently selected directory
 lbl_selected_dir = tk.Label(
     main_frame,
@@ -793,6 +1284,13 @@ btn_quit.grid(row=3, column=2, padx=0, pady=20)
 lbl_camera = tk.Canvas(main_frame, bg="#000000", width=640, height=480)
 lbl_camera.grid(row=0, column=1, rowspan=4, padx=0, pady=0)
 
+# Create the live image once; update_camera_feed pastes new frames into it
+preview_imgtk = ImageTk.PhotoImage("RGB", (640, 480))
+live_image_id = lbl_camera.create_image(
+    0, 0, anchor=tk.NW, image=preview_imgtk, tag="live_image"
+)
+lbl_camera.tag_lower(live_image_id)  # Keep the crop rectangle above it
+
 # Bind mouse events for crop zone selection
 lbl_camera.bind("<ButtonPress-1>", start_crop)
 lbl_camera.bind("<B1-Motion>", update_crop)
@@ -816,20 +1314,24 @@ lbl_last_photo = tk.Label(
 lbl_last_photo.imgtk = blank_imgtk  # Keep reference to avoid garbage collection
 lbl_last_photo.grid(row=0, column=2, rowspan=2, padx=10, pady=10)
 
-# Start the camera
-picam2.start()
-
-# Start updating the camera feed
-update_camera_feed()
-
 # Initially hide the main_frame
 main_frame.pack_forget()
 
 # Start monitoring the GPIO buttons
 monitor_gpio()
 
+# Start collecting finished captures from the background queue
+poll_capture_queue()
+
+# Set up the camera and buttons in the background and start the feed when
+# they are ready, so the home screen can be used straight away
+threading.Thread(target=init_hardware, daemon=True).start()
+wait_for_hardware()
+root.after_idle(mark_startup, "home_screen")
+
 # Run the GUI main loop
 root.mainloop()
 
 # Clean up GPIO before quitting
-GPIO.cleanup()
+if GPIO is not None:
+    GPIO.cleanup()
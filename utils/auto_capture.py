@@ -0,0 +1,100 @@
+import time
+
+import cv2
+import numpy as np
+
+import utils.pipeline as pipeline
+
+# Size the crop zone is shrunk to before comparing frames
+COMPARE_SIZE = (64, 48)
+
+
+# Decides when to take a capture without a button press: once a tool is in
+# the crop zone and nothing has moved for stable_ms. Each preview frame is
+# shrunk to COMPARE_SIZE and compared with a rolling average of the frames
+# before it. After a capture, the scene has to change (the tool is moved or
+# swapped) before it fires again.
+class AutoCapture:
+    def __init__(
+        self,
+        stable_ms=800,
+        motion_level=3.0,
+        change_level=6.0,
+        min_object_fraction=0.01,
+        reference_weight=0.3,
+    ):
+        self.stable_ms = stable_ms
+        self.motion_level = motion_level  # Mean gray levels of change
+        self.change_level = change_level
+        self.min_object_fraction = min_object_fraction
+        self.reference_weight = reference_weight
+
+        # Reused for every frame
+        self._small = np.empty(COMPARE_SIZE[::-1], dtype=np.uint8)
+        self._small_float = np.empty(COMPARE_SIZE[::-1], dtype=np.float32)
+        self._dark = np.empty(COMPARE_SIZE[::-1], dtype=np.uint8)
+        self._reference = None  # Rolling average of recent frames, in reset()
+        self._captured = np.empty(COMPARE_SIZE[::-1], dtype=np.float32)
+        self.reset()
+
+    # Function to forget the scene, e.g. when the crop zone changes
+    def reset(self):
+        self._reference = None
+        self._stable_since = None
+        self._armed = True
+        self.motion = 0.0
+
+    # Function to get the mean absolute difference between the current frame
+    # and another, in gray levels
+    def _difference(self, other):
+        return cv2.norm(self._small_float, other, cv2.NORM_L1) / self._small.size
+
+    # Function to feed one grayscale frame of the crop zone. Returns True when
+    # a capture should be taken; call captured() once it has been.
+    def update(self, gray, now=None):
+        now = time.monotonic() if now is None else now
+        if gray.size == 0:
+            return False
+
+        cv2.resize(gray, COMPARE_SIZE, dst=self._small, interpolation=cv2.INTER_AREA)
+        np.copyto(self._small_float, self._small)
+        if self._reference is None:
+            self._reference = self._small_float.copy()
+            self._stable_since = now
+            return False
+
+        self.motion = self._difference(self._reference)
+        cv2.accumulateWeighted(
+            self._small_float, self._reference, self.reference_weight
+        )
+        if self.motion > self.motion_level:
+            self._stable_since = now
+            return False
+
+        # Once fired, wait until the scene is no longer the captured one
+        if not self._armed:
+            if self._difference(self._captured) <= self.change_level:
+                self._stable_since = now
+                return False
+            self._armed = True
+            self._stable_since = now
+
+        if (now - self._stable_since) * 1000 < self.stable_ms:
+            return False
+
+        # Only fire if something dark, like a tool, fills part of the zone
+        cv2.threshold(
+            self._small,
+            pipeline.THRESHOLD_LEVEL,
+            1,
+            cv2.THRESH_BINARY_INV,
+            dst=self._dark,
+        )
+        return (
+            cv2.countNonZero(self._dark) >= self.min_object_fraction * self._dark.size
+        )
+
+    # Function to record that the current scene was captured
+    def captured(self):
+        np.copyto(self._captured, self._small_float)
+        self._armed = False
@@ -1,7 +1,7 @@
-import numpy as np
+import json
+import os
 
-# import cv2 as cv
-# import glob
+import numpy as np
 
 ret = 0.0777360425494162
 
@@ -34,56 +34,41 @@ tvecs = (
 )
 
 
-# termination criteria
-# criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
-
-# prepare object points, like (0,0,0), (1,0,0), (2,0,0) ....,(6,5,0)
-# objp = np.zeros((7*7,3), np.float32)
-# objp[:,:2] = np.mgrid[0:7,0:7].T.reshape(-1,2)
-
-# Arrays to store object points and image points from all the images.
-# objpoints = [] # 3d point in real world space
-# imgpoints = [] # 2d points in image plane.
-
-# images = glob.glob('utils/*.jpg')
-
-# for fname in images:
-#    img = cv.imread(fname)
-#    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-
-# Find the chess board corners
-#    ret, corners = cv.findChessboardCorners(gray, (7,7), None)
-
-# If found, add object points, image points (after refining them)
-#    if ret == True:
-#        objpoints.append(objp)
-
-#        corners2 = cv.cornerSubPix(gray,corners, (11,11), (-1,-1), criteria)
-#        imgpoints.append(corners2)
-
-#        # Draw and display the corners
-#        cv.drawChessboardCorners(img, (7,7), corners2, ret)
-#        cv.imshow('img', img)
-#        cv.waitKey(500)
-
-# cv.destroyAllWindows()
-
-# ret, mtx, dist, rvecs, tvecs = cv.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
-# print(f"ret: {ret}")
-# print(f"mtx: {mtx}")
-# print(f"dist: {dist}")
-# print(f"rvecs: {rvecs}")
-# print(f"tvecs: {tvecs}")
-
-
-# img = cv.imread('utils/captured_image_1.jpg')
-# h,  w = img.shape[:2]
-# newcameramtx, roi = cv.getOptimalNewCameraMatrix(mtx, dist, (w,h), 1, (w,h))
-
-# undistort
-# dst = cv.undistort(img, mtx, dist, None, newcameramtx)
-
-# crop the image
-# x, y, w, h = roi
-# dst = dst[y:y+h, x:x+w]
-# cv.imwrite('calibresult.png', dst)
+# The values above are a fallback. Run "python -m utils.calibrate" to
+# calibrate from chessboard photos; it writes CALIBRATION_FILE, which
+# load_calibration() prefers when it exists.
+CALIBRATION_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "lens_calibration.json"
+)
+CALIBRATION_VERSION = 1
+
+# Resolution the values above were calibrated at
+CALIBRATION_SIZE = (640, 480)
+
+
+# Function to get the lens model from a calibration file, or the values
+# above if there is no usable file. Returns {"mtx", "dist", "image_size",
+# "path"}, where path is None for the built-in values.
+def load_calibration(path=CALIBRATION_FILE):
+    built_in = {"mtx": mtx, "dist": dist, "image_size": CALIBRATION_SIZE, "path": None}
+    try:
+        with open(path) as f:
+            calibration = json.load(f)
+    except FileNotFoundError:
+        return built_in
+    except (OSError, ValueError) as e:
+        print(f"Could not read lens calibration {path}: {e}")
+        return built_in
+
+    if calibration.get("version") != CALIBRATION_VERSION:
+        print(
+            f"Ignoring lens calibration {path}: version "
+            f"{calibration.get('version')}, expected {CALIBRATION_VERSION}"
+        )
+        return built_in
+    return {
+        "mtx": np.array(calibration["camera_matrix"]),
+        "dist": np.array(calibration["dist_coeffs"]),
+        "image_size": tuple(calibration["image_size"]),
+        "path": path,
+    }
@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+import utils.barrel as barrel
+import utils.combine as combine
+import utils.dxf as dxf
+import utils.layout as layout
+import utils.persist as persist
+import utils.pipeline as pipeline
+from utils.trace_cache import TraceCache
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Each worker process opens the shared on-disk trace cache once
+_trace_cache = None
+
+
+# Function to sort captured_image_2 before captured_image_10
+def _natural_key(filename):
+    return [
+        int(part) if part.isdigit() else part for part in re.split(r"(\d+)", filename)
+    ]
+
+
+# Function to name the SVG after the photo it came from
+def _svg_name(image_name):
+    stem = os.path.splitext(image_name)[0]
+    match = re.fullmatch(r"captured_image_(\d+)", stem)
+    if match:
+        return f"output_image_{match.group(1)}.svg"
+    return f"{stem}.svg"
+
+
+# Function to load pixels per cm from a reference_calibration.py output file
+def load_pixels_per_cm(calibration_path):
+    with open(calibration_path) as f:
+        return float(json.load(f)["pixels_per_cm"])
+
+
+# Function run in each worker process to convert one photo
+def _process_file(job):
+    global _trace_cache
+    (
+        image_path,
+        svg_path,
+        crop_coords,
+        lens,
+        pixels_per_cm,
+        tolerance_mm,
+        use_trace_cache,
+        dxf_path,
+    ) = job
+    if use_trace_cache and _trace_cache is None:
+        _trace_cache = TraceCache()
+
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not read image {image_path}")
+
+    mtx, dist, calibration_size = (
+        (lens["mtx"], lens["dist"], lens["image_size"]) if lens else (None, None, None)
+    )
+    _, svg_info = pipeline.process_image(
+        image,
+        svg_path,
+        mtx,
+        dist,
+        crop_coords,
+        pixels_per_cm,
+        calibration_size=calibration_size,
+        simplify_tolerance_mm=tolerance_mm,
+        trace_cache=_trace_cache if use_trace_cache else None,
+        dxf_path=dxf_path,
+    )
+    return svg_info
+
+
+# Function to convert every photo in a folder to SVGs and a combined sheet.
+# Only raw camera frames need undistort_image; the kiosk archives its photos
+# already undistorted and cropped.
+def convert_folder(
+    input_directory,
+    output_directory,
+    crop_coords=None,
+    undistort_image=False,
+    pixels_per_cm=pipeline.PIXELS_PER_CM,
+    workers=None,
+    sheet_size_cm=None,
+    margin_cm=0.5,
+    allow_rotation=True,
+    lens_calibration=barrel.CALIBRATION_FILE,
+    simplify_tolerance_mm=pipeline.SIMPLIFY_TOLERANCE_MM,
+    use_trace_cache=True,
+    export_dxf=False,
+):
+    lens = barrel.load_calibration(lens_calibration) if undistort_image else None
+
+    image_names = sorted(
+        (
+            f
+            for f in os.listdir(input_directory)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        ),
+        key=_natural_key,
+    )
+    if not image_names:
+        raise ValueError(f"No images found in {input_directory}")
+
+    svgs_dir = os.path.join(output_directory, "svgs")
+    os.makedirs(svgs_dir, exist_ok=True)
+    dxfs_dir = os.path.join(output_directory, "dxfs")
+    if export_dxf:
+        os.makedirs(dxfs_dir, exist_ok=True)
+
+    jobs = [
+        (
+            os.path.join(input_directory, name),
+            os.path.join(svgs_dir, _svg_name(name)),
+            crop_coords,
+            lens,
+            pixels_per_cm,
+            simplify_tolerance_mm,
+            use_trace_cache,
+            (
+                os.path.join(dxfs_dir, os.path.splitext(_svg_name(name))[0] + ".dxf")
+                if export_dxf
+                else None
+            ),
+        )
+        for name in image_names
+    ]
+
+    # Process the images on all cores, keeping the results in photo order
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        svg_infos = list(executor.map(_process_file, jobs))
+    print(
+        "Outline nodes: "
+        f"{sum(svg_info['nodes']['before'] for svg_info in svg_infos)} traced, "
+        f"{sum(svg_info['nodes']['after'] for svg_info in svg_infos)} "
+        "after simplification"
+    )
+    if use_trace_cache:
+        hits = sum(svg_info["trace_cached"] for svg_info in svg_infos)
+        print(f"Trace cache: {hits} hits, {len(svg_infos) - hits} misses")
+
+    svg_files = [svg_info["svg_path"] for svg_info in svg_infos]
+    combined_svg_path = os.path.join(output_directory, "combined_output.svg")
+    combined_dxf_path = os.path.join(output_directory, "combined_output.dxf")
+    if sheet_size_cm:
+        sheet_paths, sheets = combine.layout_svgs(
+            svg_infos,
+            combined_svg_path,
+            sheet_size_cm,
+            pixels_per_cm,
+            margin_cm,
+            allow_rotation,
+            workers or persist.PARALLEL_WRITERS,
+        )
+        print(
+            f"Nested onto {len(sheets)} sheet(s), "
+            f"{layout.total_utilization(sheets):.1%} of the sheet area used"
+        )
+        extra_paths = {}
+        if export_dxf:
+            extra_paths["dxf"] = dxf.combine_dxfs(
+                svg_infos,
+                combined_dxf_path,
+                pixels_per_cm,
+                sheets,
+                workers or persist.PARALLEL_WRITERS,
+            )
+        index_path = combine.write_sheet_index(
+            combine.sheet_index_path(combined_svg_path),
+            sheet_paths,
+            sheets,
+            svg_infos,
+            pixels_per_cm,
+            extra_paths,
+        )
+        return svg_files, sheet_paths + extra_paths.get("dxf", []) + [index_path]
+
+    combine.combine_svgs(svg_infos, combined_svg_path, pixels_per_cm)
+    if export_dxf:
+        dxf.combine_dxfs(svg_infos, combined_dxf_path, pixels_per_cm)
+        return svg_files, [combined_svg_path, combined_dxf_path]
+    return svg_files, [combined_svg_path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert a folder of tool photos to SVGs and a combined sheet."
+    )
+    parser.add_argument(
+        "input_directory", help="folder of photos, e.g. a run's photos/"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="folder to write svgs/ and the combined sheet to "
+        "(default: the parent of the input folder)",
+    )
+    parser.add_argument(
+        "--crop",
+        nargs=4,
+        type=int,
+        metavar=("X0", "Y0", "X1", "Y1"),
+        help="crop box in image pixels, after undistortion with --undistort "
+        "(default: no crop)",
+    )
+    parser.add_argument(
+        "--calibration",
+        help="calibration_data.json from reference_calibration.py "
+        f"(default: {pipeline.PIXELS_PER_CM} pixels per cm)",
+    )
+    parser.add_argument(
+        "--lens-calibration",
+        default=barrel.CALIBRATION_FILE,
+        help="lens calibration file from utils/calibrate.py, used with --undistort "
+        "(default: %(default)s if it exists, else the values in barrel.py)",
+    )
+    parser.add_argument(
+        "--undistort",
+        action="store_true",
+        help="undistort the photos first, for raw camera frames; photos the kiosk "
+        "saved in photos/ are already undistorted and cropped",
+    )
+    parser.add_argument(
+        "--simplify",
+        type=float,
+        default=pipeline.SIMPLIFY_TOLERANCE_MM,
+        metavar="MM",
+        help="simplify outlines to within this many mm, 0 to turn off "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-trace-cache",
+        action="store_true",
+        help="trace every photo again instead of reusing cached traces",
+    )
+    parser.add_argument(
+        "--dxf",
+        action="store_true",
+        help="also write each outline and the combined sheet(s) as DXF, in mm",
+    )
+    parser.add_argument(
+        "--sheet",
+        nargs=2,
+        type=float,
+        metavar=("WIDTH_CM", "HEIGHT_CM"),
+        help="nest the parts onto sheets of this size instead of stacking them",
+    )
+    parser.add_argument(
+        "--margin", type=float, default=0.5, help="spacing between nested parts in cm"
+    )
+    parser.add_argument(
+        "--no-rotate",
+        action="store_true",
+        help="don't turn parts 90 degrees when nesting",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="number of worker processes (default: all cores)",
+    )
+    args = parser.parse_args(argv)
+
+    input_directory = os.path.abspath(args.input_directory)
+    output_directory = args.output or os.path.dirname(input_directory)
+    pixels_per_cm = (
+        load_pixels_per_cm(args.calibration)
+        if args.calibration
+        else pipeline.PIXELS_PER_CM
+    )
+
+    svg_files, sheet_paths = convert_folder(
+        input_directory,
+        output_directory,
+        crop_coords=args.crop,
+        undistort_image=args.undistort,
+        pixels_per_cm=pixels_per_cm,
+        workers=args.workers,
+        sheet_size_cm=args.sheet,
+        margin_cm=args.margin,
+        allow_rotation=not args.no_rotate,
+        lens_calibration=args.lens_calibration,
+        simplify_tolerance_mm=args.simplify,
+        use_trace_cache=not args.no_trace_cache,
+        export_dxf=args.dxf,
+    )
+    print(f"Converted {len(svg_files)} images, saved as {', '.join(sheet_paths)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Burst capture: several frames taken back to back and combined pixel by
+# pixel before tracing, which evens out sensor noise and flicker so the
+# outline edge is cleaner and potrace emits fewer nodes
+import queue
+
+import numpy as np
+
+BURST_METHODS = ("median", "mean")
+
+
+# Function to sort a stack of frames pixel by pixel, in place, with an
+# odd-even transposition network. Each step is one np.minimum/np.maximum over
+# whole frames, which is much faster than np.median along the frame axis.
+def _sort_stack(frames, scratch):
+    count = len(frames)
+    for step in range(count):
+        for i in range(step % 2, count - 1, 2):
+            np.minimum(frames[i], frames[i + 1], out=scratch)
+            np.maximum(frames[i], frames[i + 1], out=frames[i + 1])
+            frames[i][...] = scratch
+
+
+# Function to combine a (count, height, width, channels) uint8 stack into
+# one frame with the per-pixel median or mean. The median reorders the
+# stack in place.
+def stack_frames(frames, method="median", out=None):
+    count = len(frames)
+    if out is None:
+        out = np.empty(frames.shape[1:], dtype=frames.dtype)
+    if count == 1:
+        out[...] = frames[0]
+        return out
+
+    if method == "median":
+        _sort_stack(frames, out)
+        if count % 2:
+            out[...] = frames[count // 2]
+        else:
+            # Rounded mean of the two middle values, without overflowing
+            lower, upper = frames[count // 2 - 1], frames[count // 2]
+            np.add(lower // 2, upper // 2, out=out)
+            out += (lower & 1) | (upper & 1)
+    elif method == "mean":
+        total = frames.sum(axis=0, dtype=np.uint16)
+        total += count // 2  # Round to nearest
+        np.floor_divide(total, count, out=total)
+        out[...] = total
+    else:
+        raise ValueError(f"Unknown burst method {method!r}, use one of {BURST_METHODS}")
+    return out
+
+
+# Preallocated frame stacks for bursts, handed out one per capture and given
+# back once the capture has been stacked, so bursts don't allocate
+class StackPool:
+    def __init__(self, count, shape, stacks=1, dtype=np.uint8):
+        self.count = count
+        self.shape = tuple(shape)
+        self._free = queue.Queue()
+        for _ in range(stacks):
+            self._free.put(np.empty((count, *self.shape), dtype=dtype))
+
+    # Function to take a free stack, waiting if they are all in use
+    def acquire(self, timeout=None):
+        return self._free.get(timeout=timeout)
+
+    def release(self, stack):
+        self._free.put(stack)
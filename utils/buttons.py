@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+
+
+# Watches buttons with GPIO edge detection and queues (button, gesture)
+# events for the GUI thread to handle. Gestures are "press", "long" and
+# "double". Buttons without long or double press actions report "press" as
+# soon as they go down; the others are reported when released.
+class ButtonMonitor:
+    def __init__(
+        self,
+        gpio,
+        pins,
+        long_press_buttons=(),
+        double_press_buttons=(),
+        bouncetime_ms=50,
+        long_press_s=0.8,
+        double_press_s=0.35,
+    ):
+        self.gpio = gpio
+        self.pins = dict(pins)  # button name -> BCM pin
+        self.long_press_buttons = set(long_press_buttons)
+        self.double_press_buttons = set(double_press_buttons)
+        self.long_press_s = long_press_s
+        self.double_press_s = double_press_s
+        self.events = queue.Queue()
+
+        self._names = {pin: name for name, pin in self.pins.items()}
+        self._pressed_at = {}
+        self._double_timers = {}
+        self._lock = threading.Lock()
+
+        for pin in self.pins.values():
+            gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+            gpio.add_event_detect(
+                pin, gpio.BOTH, callback=self._edge, bouncetime=bouncetime_ms
+            )
+
+    def _emit(self, name, gesture):
+        self.events.put((name, gesture))
+
+    # Called by the GPIO library on its own thread for every debounced edge
+    def _edge(self, pin):
+        name = self._names.get(pin)
+        if name is None:
+            return
+        now = time.monotonic()
+        waits_for_release = (
+            name in self.long_press_buttons or name in self.double_press_buttons
+        )
+
+        with self._lock:
+            if self.gpio.input(pin) == self.gpio.LOW:
+                # Pulled up, so LOW means the button went down
+                self._pressed_at[pin] = now
+                if not waits_for_release:
+                    self._emit(name, "press")
+                return
+
+            pressed_at = self._pressed_at.pop(pin, None)
+            if pressed_at is None or not waits_for_release:
+                return
+
+            if (
+                name in self.long_press_buttons
+                and now - pressed_at >= self.long_press_s
+            ):
+                self._emit(name, "long")
+            elif name in self.double_press_buttons:
+                pending = self._double_timers.pop(name, None)
+                if pending is not None:
+                    pending[0].cancel()
+                    self._emit(name, "double")
+                else:
+                    # Wait to see whether a second press follows
+                    token = object()
+                    timer = threading.Timer(
+                        self.double_press_s, self._single_press, args=(name, token)
+                    )
+                    timer.daemon = True
+                    self._double_timers[name] = (timer, token)
+                    timer.start()
+            else:
+                self._emit(name, "press")
+
+    def _single_press(self, name, token):
+        with self._lock:
+            pending = self._double_timers.get(name)
+            if pending is None or pending[1] is not token:
+                return  # A second press made it a double press
+            del self._double_timers[name]
+        self._emit(name, "press")
+
+    # Function to collect queued events without blocking
+    def poll(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    # Function to stop edge detection on the monitored pins
+    def close(self):
+        with self._lock:
+            for timer, _ in self._double_timers.values():
+                timer.cancel()
+            self._double_timers.clear()
+        for pin in self.pins.values():
+            try:
+                self.gpio.remove_event_detect(pin)
+            except RuntimeError:
+                pass
@@ -0,0 +1,316 @@
+# Lens calibration from a folder of chessboard photos.
+#
+#   python -m utils.calibrate [IMAGES ...] [-o utils/lens_calibration.json]
+#
+# Corners are found in parallel and cached per image, keyed by a hash of the
+# file, so re-running after adding photos only processes the new ones. The
+# result is written to a versioned file that shadowboards.py loads at
+# startup (see barrel.load_calibration).
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import utils.barrel as barrel
+import utils.persist as persist
+
+DEFAULT_IMAGES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "captured_image_*.jpg"
+)
+PATTERN_SIZE = (7, 7)  # Inner corners of the chessboard
+CORNER_CACHE_VERSION = 1
+
+# termination criteria for the sub-pixel corner refinement
+CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+# Function to hash an image file's contents
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function run in each worker process to find the corners in one photo
+def find_corners(job):
+    path, pattern_size = job
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return {"size": None, "corners": None}
+
+    size = [image.shape[1], image.shape[0]]
+    found, corners = cv2.findChessboardCorners(image, tuple(pattern_size), None)
+    if not found:
+        return {"size": size, "corners": None}
+
+    corners = cv2.cornerSubPix(image, corners, (11, 11), (-1, -1), CRITERIA)
+    return {"size": size, "corners": corners.reshape(-1, 2).tolist()}
+
+
+# Function to load cached corner detections, or an empty cache if the file is
+# missing or was made for another pattern
+def load_corner_cache(cache_path, pattern_size):
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != CORNER_CACHE_VERSION or cache.get("pattern") != list(
+        pattern_size
+    ):
+        return {}
+    return cache.get("images", {})
+
+
+def save_corner_cache(cache_path, pattern_size, detections):
+    cache = {
+        "version": CORNER_CACHE_VERSION,
+        "pattern": list(pattern_size),
+        "images": detections,
+    }
+    persist.atomic_write(cache_path, json.dumps(cache).encode())
+
+
+# Function to get the corners of every image, only detecting uncached ones.
+# Returns a list of {"path", "hash", "size", "corners"} in input order.
+def detect_corners(image_paths, pattern_size, cache_path, workers=None):
+    cached = load_corner_cache(cache_path, pattern_size)
+    hashes = [file_hash(path) for path in image_paths]
+
+    missing = [
+        (path, digest)
+        for path, digest in zip(image_paths, hashes)
+        if digest not in cached
+    ]
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                find_corners, [(path, pattern_size) for path, _ in missing]
+            )
+            for (_, digest), result in zip(missing, results):
+                cached[digest] = result
+        save_corner_cache(cache_path, pattern_size, cached)
+    print(
+        f"Corners: {len(image_paths) - len(missing)} images from cache, "
+        f"{len(missing)} detected"
+    )
+
+    return [
+        {"path": path, "hash": digest, **cached[digest]}
+        for path, digest in zip(image_paths, hashes)
+    ]
+
+
+# Function to get the chessboard corners in board coordinates
+def board_points(pattern_size, square_size):
+    cols, rows = pattern_size
+    points = np.zeros((cols * rows, 3), np.float32)
+    points[:, :2] = np.mgrid[0:cols, 0:rows].T.reshape(-1, 2) * square_size
+    return points
+
+
+# Function to calibrate from detections; returns the RMS error, camera
+# matrix, distortion coefficients and each view's reprojection error
+def calibrate(detections, image_size, pattern_size, square_size=1.0):
+    objp = board_points(pattern_size, square_size)
+    object_points = [objp for _ in detections]
+    image_points = [
+        np.array(detection["corners"], np.float32).reshape(-1, 1, 2)
+        for detection in detections
+    ]
+
+    rms, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(
+        object_points, image_points, tuple(image_size), None, None
+    )
+
+    errors = []
+    for points, rvec, tvec in zip(image_points, rvecs, tvecs):
+        projected, _ = cv2.projectPoints(objp, rvec, tvec, mtx, dist)
+        errors.append(
+            float(np.sqrt(np.mean(np.sum((points - projected) ** 2, axis=2))))
+        )
+    return rms, mtx, dist, rvecs, tvecs, errors
+
+
+# Function to run the whole calibration and write the calibration file.
+# Views whose reprojection error is above max_error_px are dropped and the
+# camera calibrated again without them.
+def run_calibration(
+    image_paths,
+    output_path=barrel.CALIBRATION_FILE,
+    pattern_size=PATTERN_SIZE,
+    square_size=1.0,
+    max_error_px=None,
+    exclude=(),
+    cache_path=None,
+    workers=None,
+):
+    if cache_path is None:
+        cache_path = os.path.join(
+            os.path.dirname(os.path.abspath(output_path)), "calibration_corners.json"
+        )
+    detections = detect_corners(image_paths, pattern_size, cache_path, workers)
+
+    # All views must be the same size; use the most common one
+    sizes = [tuple(d["size"]) for d in detections if d["corners"] is not None]
+    if not sizes:
+        raise ValueError("No chessboard found in any image")
+    image_size = max(set(sizes), key=sizes.count)
+
+    report = []
+    usable = []
+    excluded = {os.path.basename(name) for name in exclude}
+    for detection in detections:
+        entry = {
+            "file": os.path.basename(detection["path"]),
+            "hash": detection["hash"],
+        }
+        if detection["corners"] is None:
+            entry["skipped"] = "no chessboard found"
+        elif tuple(detection["size"]) != image_size:
+            entry["skipped"] = f"size {detection['size'][0]}x{detection['size'][1]}"
+        elif entry["file"] in excluded:
+            entry["skipped"] = "excluded"
+        else:
+            usable.append((entry, detection))
+        report.append(entry)
+
+    if len(usable) < 3:
+        raise ValueError(f"Need at least 3 usable views, found {len(usable)}")
+
+    while True:
+        rms, mtx, dist, rvecs, tvecs, errors = calibrate(
+            [detection for _, detection in usable],
+            image_size,
+            pattern_size,
+            square_size,
+        )
+        for (entry, _), error, rvec, tvec in zip(usable, errors, rvecs, tvecs):
+            entry.update(
+                error_px=error, rvec=rvec.ravel().tolist(), tvec=tvec.ravel().tolist()
+            )
+
+        if max_error_px is None:
+            break
+        worst = max(range(len(usable)), key=errors.__getitem__)
+        if errors[worst] <= max_error_px:
+            break
+        if len(usable) <= 3:
+            # Don't overwrite a calibration with one that misses the target
+            raise ValueError(
+                f"Only 3 views are left and {usable[worst][0]['file']} is still "
+                f"{errors[worst]:.3f} px off, above the {max_error_px} px maximum; "
+                "add more photos or raise --max-error. Nothing was saved."
+            )
+        # Drop the worst view and calibrate again
+        entry, _ = usable.pop(worst)
+        entry["skipped"] = f"reprojection error {entry.pop('error_px'):.3f} px"
+        del entry["rvec"], entry["tvec"]
+
+    calibration = {
+        "version": barrel.CALIBRATION_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "image_size": list(image_size),
+        "pattern_size": list(pattern_size),
+        "square_size": square_size,
+        "rms_px": rms,
+        "camera_matrix": mtx.tolist(),
+        "dist_coeffs": dist.tolist(),
+        "images": report,
+    }
+    persist.atomic_write(output_path, json.dumps(calibration, indent=2).encode())
+    return calibration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Calibrate the camera lens from chessboard photos."
+    )
+    parser.add_argument(
+        "images",
+        nargs="*",
+        help="chessboard photos or folders of them "
+        f"(default: {os.path.relpath(DEFAULT_IMAGES)})",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=barrel.CALIBRATION_FILE,
+        help="calibration file to write (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pattern",
+        nargs=2,
+        type=int,
+        default=PATTERN_SIZE,
+        metavar=("COLS", "ROWS"),
+        help="inner corners of the chessboard (default: 7 7)",
+    )
+    parser.add_argument(
+        "--square-size",
+        type=float,
+        default=1.0,
+        help="size of one chessboard square, in any unit",
+    )
+    parser.add_argument(
+        "--max-error",
+        type=float,
+        help="drop views with a reprojection error above this many pixels, "
+        "failing without saving if the last 3 views are still above it",
+    )
+    parser.add_argument(
+        "--exclude", nargs="+", default=[], help="file names of views to leave out"
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="number of worker processes (default: all cores)",
+    )
+    args = parser.parse_args(argv)
+
+    image_paths = []
+    for pattern in args.images or [DEFAULT_IMAGES]:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        image_paths += sorted(
+            path
+            for path in glob.glob(pattern)
+            if path.lower().endswith((".jpg", ".jpeg", ".png"))
+        )
+    if not image_paths:
+        parser.error("no images found")
+
+    try:
+        calibration = run_calibration(
+            image_paths,
+            args.output,
+            tuple(args.pattern),
+            args.square_size,
+            args.max_error,
+            args.exclude,
+            workers=args.workers,
+        )
+    except ValueError as e:
+        sys.exit(f"Calibration failed: {e}")
+
+    for entry in calibration["images"]:
+        if "skipped" in entry:
+            print(f"{entry['file']:<30}skipped: {entry['skipped']}")
+        else:
+            print(f"{entry['file']:<30}{entry['error_px']:8.3f} px")
+    print(f"RMS reprojection error {calibration['rms_px']:.3f} px")
+    print(f"Calibration saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+# Camera process that publishes frames into shared-memory ring buffers.
+#
+#   python -m utils.camera_daemon [--main-size W H] [--lores-size W H] ...
+#
+# shadowboards.py starts it with CameraDaemon, so grabbing frames never
+# competes with the GUI or the capture workers for the GIL. Every frame of
+# the main and lores streams is written to its own ring under the same
+# sequence number, and the GUI reads them in place by sequence number.
+# Commands ("still", "stop") come in one JSON line at a time on stdin and
+# replies go out on stdout.
+import argparse
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+RING_SLOTS = 4
+STILL_SLOTS = 2
+CAMERA_FPS = 30
+STARTUP_TIMEOUT_S = 30
+STILL_TIMEOUT_S = 10
+
+# Ring header: the latest sequence number and the frames dropped so far,
+# followed by the sequence number held by each slot (-1 while written)
+_LATEST = 0
+_DROPPED = 1
+_HEADER_FIELDS = 2
+
+
+# Fixed-size frames in one shared-memory block, written by a single process
+# and read in place by others. A reader can tell from the slot's sequence
+# number whether the frame it is looking at has been overwritten since.
+class FrameRing:
+    def __init__(self, shape, dtype=np.uint8, slots=RING_SLOTS, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        header_bytes = (_HEADER_FIELDS + slots) * 8
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=header_bytes + frame_bytes * slots
+            )
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Python < 3.13 tracks attached blocks too and would remove this
+            # one when the reader exits; only the writer should
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        self.header = np.ndarray((_HEADER_FIELDS + slots,), np.int64, self.shm.buf)
+        self.frames = np.ndarray(
+            (slots, *self.shape), self.dtype, self.shm.buf, offset=header_bytes
+        )
+        if self.owner:
+            self.header[:] = -1
+            self.header[_DROPPED] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # Function to publish a frame under the next sequence number
+    def write(self, frame):
+        seq = int(self.header[_LATEST]) + 1
+        slot = seq % self.slots
+        self.header[_HEADER_FIELDS + slot] = -1
+        self.frames[slot] = frame
+        self.header[_HEADER_FIELDS + slot] = seq
+        self.header[_LATEST] = seq
+        return seq
+
+    def add_dropped(self, count):
+        self.header[_DROPPED] += count
+
+    def latest_seq(self):
+        return int(self.header[_LATEST])
+
+    def dropped(self):
+        return int(self.header[_DROPPED])
+
+    # Function to check that a frame is still in the ring and not being
+    # overwritten
+    def is_current(self, seq):
+        return seq >= 0 and self.header[_HEADER_FIELDS + seq % self.slots] == seq
+
+    # Function to get a frame by sequence number without copying it, or None
+    # if it isn't in the ring. The view is only good until the writer comes
+    # round to its slot again, which is_current() tells.
+    def view(self, seq):
+        if not self.is_current(seq):
+            return None
+        return self.frames[seq % self.slots]
+
+    # Function to copy a frame out of the ring, or None if it was
+    # overwritten before or during the copy
+    def copy(self, seq):
+        frame = self.view(seq)
+        if frame is None:
+            return None
+        frame = frame.copy()
+        return frame if self.is_current(seq) else None
+
+    def close(self):
+        # The arrays point into the block, so drop them before closing it
+        self.header = self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            return  # A caller still holds a view; the OS frees it at exit
+        if self.owner:
+            self.shm.unlink()
+
+
+# Function run in the camera process: open the camera, publish frames until
+# told to stop or stdin closes. Up to burst stills can be taken in one go.
+def run(main_size, lores_size, stills, still_size, fps, slots, burst, replies):
+    from picamera2 import Picamera2
+
+    picam2 = Picamera2()
+    preview_config = picam2.create_preview_configuration(
+        main={"size": tuple(main_size), "format": "RGB888"},
+        lores={"size": tuple(lores_size), "format": "YUV420"},
+        controls={"FrameRate": fps},
+    )
+    picam2.configure(preview_config)
+    still_config = None
+    if stills:
+        still_size = tuple(still_size or picam2.sensor_resolution)
+        still_config = picam2.create_still_configuration(
+            main={"size": still_size, "format": "RGB888"}
+        )
+    picam2.start()
+
+    # Size the rings from a real frame, the lores buffer may be padded
+    request = picam2.capture_request()
+    try:
+        first = {name: request.make_array(name) for name in ("main", "lores")}
+    finally:
+        request.release()
+    rings = {
+        name: FrameRing(frame.shape, frame.dtype, slots)
+        for name, frame in first.items()
+    }
+    if still_config is not None:
+        rings["still"] = FrameRing(
+            (still_size[1], still_size[0], 3), np.uint8, max(STILL_SLOTS, burst)
+        )
+
+    # Commands are read on a thread so the frame loop never blocks on stdin
+    commands = queue.Queue()
+
+    def read_commands():
+        for line in sys.stdin:
+            commands.put(json.loads(line))
+        commands.put({"command": "stop"})  # The GUI went away
+
+    threading.Thread(target=read_commands, daemon=True).start()
+
+    def reply(message):
+        replies.write(json.dumps(message) + "\n")
+        replies.flush()
+
+    try:
+        reply(
+            {
+                "ready": True,
+                "capture_size": list(still_size if still_config else main_size),
+                "rings": {
+                    name: {
+                        "name": ring.name,
+                        "shape": ring.shape,
+                        "dtype": ring.dtype.str,
+                        "slots": ring.slots,
+                    }
+                    for name, ring in rings.items()
+                },
+            }
+        )
+
+        frame_duration_ns = 1e9 / fps
+        last_timestamp = None
+        while True:
+            try:
+                command = commands.get_nowait()
+            except queue.Empty:
+                command = None
+            if command is not None:
+                if command["command"] == "stop":
+                    break
+                if command["command"] == "still":
+                    try:
+                        reply(
+                            {
+                                "seqs": capture_stills(
+                                    picam2,
+                                    preview_config,
+                                    still_config,
+                                    rings["still"],
+                                    command.get("count", 1),
+                                )
+                            }
+                        )
+                    except Exception as e:
+                        reply({"error": str(e)})
+                    last_timestamp = None  # The mode switch isn't a drop
+                    continue
+
+            request = picam2.capture_request()
+            try:
+                timestamp = request.get_metadata().get("SensorTimestamp")
+                rings["main"].write(request.make_array("main"))
+                rings["lores"].write(request.make_array("lores"))
+            finally:
+                request.release()
+
+            # A gap in the sensor timestamps means frames came and went
+            # while this loop was busy
+            if timestamp is not None and last_timestamp is not None:
+                missed = round((timestamp - last_timestamp) / frame_duration_ns) - 1
+                if missed > 0:
+                    rings["main"].add_dropped(missed)
+                    rings["lores"].add_dropped(missed)
+            last_timestamp = timestamp
+    finally:
+        picam2.stop()
+        picam2.close()
+        for ring in rings.values():
+            ring.close()
+
+
+# Function to take count stills back to back into the still ring, then go
+# back to the preview mode. Returns their sequence numbers.
+def capture_stills(picam2, preview_config, still_config, ring, count):
+    if count > ring.slots:
+        raise ValueError(f"Can take at most {ring.slots} stills at once")
+    if count == 1:
+        return [ring.write(picam2.switch_mode_and_capture_array(still_config))]
+
+    picam2.switch_mode(still_config)
+    try:
+        return [ring.write(picam2.capture_array("main")) for _ in range(count)]
+    finally:
+        picam2.switch_mode(preview_config)
+
+
+# Starts the camera process and reads its frames from shared memory. Frames
+# are looked up by sequence number; the same number refers to the same
+# sensor frame in the main and lores streams.
+class CameraDaemon:
+    def __init__(
+        self,
+        main_size=(640, 480),
+        lores_size=(320, 240),
+        stills=False,
+        still_size=None,
+        fps=CAMERA_FPS,
+        slots=RING_SLOTS,
+        burst=1,
+    ):
+        self.args = [
+            "--main-size",
+            *map(str, main_size),
+            "--lores-size",
+            *map(str, lores_size),
+            "--fps",
+            str(fps),
+            "--slots",
+            str(slots),
+            "--burst",
+            str(burst),
+        ]
+        if stills:
+            self.args.append("--stills")
+        if still_size:
+            self.args += ["--still-size", *map(str, still_size)]
+
+        self.process = None
+        self.rings = {}
+        self.capture_size = None
+        self.skipped = {}  # Stream -> frames published but never read
+        self._last_read = {}
+        self._replies = queue.Queue()
+        self._lock = threading.Lock()
+
+    # Function to launch the camera process; returns straight away
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "utils.camera_daemon", *self.args],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        threading.Thread(target=self._read_replies, daemon=True).start()
+        return self
+
+    def _read_replies(self):
+        for line in self.process.stdout:
+            self._replies.put(json.loads(line))
+        self._replies.put({"error": "The camera process exited"})
+
+    def _reply(self, timeout):
+        try:
+            message = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError("The camera process did not answer") from None
+        if "error" in message:
+            raise RuntimeError(message["error"])
+        return message
+
+    # Function to wait for the first frames and attach to the rings
+    def wait_ready(self, timeout=STARTUP_TIMEOUT_S):
+        message = self._reply(timeout)
+        self.capture_size = tuple(message["capture_size"])
+        for name, ring in message["rings"].items():
+            self.rings[name] = FrameRing(
+                ring["shape"], ring["dtype"], ring["slots"], ring["name"]
+            )
+            self.skipped[name] = 0
+            self._last_read[name] = -1
+        return self
+
+    def _send(self, command, **args):
+        self.process.stdin.write(json.dumps({"command": command, **args}) + "\n")
+        self.process.stdin.flush()
+
+    # Function to get the latest frame of a stream without copying it, as
+    # (seq, view), or (-1, None) before the first frame
+    def latest(self, name="lores"):
+        ring = self.rings[name]
+        seq = ring.latest_seq()
+        frame = ring.view(seq)
+        if frame is None:
+            return -1, None
+        if seq > self._last_read[name] + 1:
+            self.skipped[name] += seq - self._last_read[name] - 1
+        self._last_read[name] = max(self._last_read[name], seq)
+        return seq, frame
+
+    # Function to check a frame from latest() wasn't overwritten while used
+    def is_current(self, name, seq):
+        return self.rings[name].is_current(seq)
+
+    # Function to copy the latest frame of a stream, as (seq, frame)
+    def capture(self, name="main"):
+        ring = self.rings[name]
+        while True:
+            seq = ring.latest_seq()
+            frame = ring.copy(seq)
+            if frame is not None:
+                return seq, frame
+            time.sleep(0.001)  # Overwritten while copying, take the next one
+
+    # Function to copy the next len(out) frames of a stream into out, a
+    # preallocated (count, height, width, channels) stack. Returns their
+    # sequence numbers, which are consecutive unless frames were missed.
+    def capture_burst(self, out, name="main"):
+        ring = self.rings[name]
+        seqs = []
+        seq = ring.latest_seq()
+        while len(seqs) < len(out):
+            if ring.latest_seq() < seq:
+                time.sleep(0.002)  # Wait for the camera's next frame
+                continue
+            frame = ring.view(seq)
+            if frame is not None:
+                np.copyto(out[len(seqs)], frame)
+            if frame is None or not ring.is_current(seq):
+                seq = ring.latest_seq()  # Fell behind the ring, take the newest
+                continue
+            seqs.append(seq)
+            seq += 1
+        return seqs
+
+    # Function to capture full-resolution stills back to back into out, a
+    # preallocated stack. Returns their sequence numbers. The preview stops
+    # while the camera is in the still mode.
+    def capture_stills(self, out, timeout=STILL_TIMEOUT_S):
+        with self._lock:
+            self._send("still", count=len(out))
+            seqs = self._reply(timeout)["seqs"]
+        ring = self.rings["still"]
+        for frame, seq in zip(out, seqs):
+            np.copyto(frame, ring.view(seq))
+        return seqs
+
+    # Function to capture one full-resolution still, as (seq, frame)
+    def capture_still(self, timeout=STILL_TIMEOUT_S):
+        out = np.empty((1, *self.rings["still"].shape), np.uint8)
+        seqs = self.capture_stills(out, timeout)
+        return seqs[0], out[0]
+
+    # Function to get each stream's latest sequence number, the frames the
+    # camera process dropped and the frames the GUI never read
+    def stats(self):
+        return {
+            name: {
+                "seq": ring.latest_seq(),
+                "dropped": ring.dropped(),
+                "skipped": self.skipped[name],
+            }
+            for name, ring in self.rings.items()
+        }
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+        if self.process is None:
+            return
+        try:
+            self._send("stop")
+            self.process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the camera and publish its frames into shared memory."
+    )
+    parser.add_argument("--main-size", nargs=2, type=int, default=(640, 480))
+    parser.add_argument("--lores-size", nargs=2, type=int, default=(320, 240))
+    parser.add_argument(
+        "--stills", action="store_true", help="allow full-resolution stills"
+    )
+    parser.add_argument(
+        "--still-size",
+        nargs=2,
+        type=int,
+        help="still resolution (default: the full sensor)",
+    )
+    parser.add_argument("--fps", type=float, default=CAMERA_FPS)
+    parser.add_argument("--slots", type=int, default=RING_SLOTS)
+    parser.add_argument(
+        "--burst", type=int, default=1, help="most stills taken in one go"
+    )
+    args = parser.parse_args(argv)
+
+    # Keep stdout for replies; anything else printed goes to stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    if os.environ.get("SHADOWBOARDS_FAKE_HARDWARE"):
+        import utils.fake_hardware as fake_hardware
+
+        fake_hardware.install()
+
+    try:
+        run(
+            args.main_size,
+            args.lores_size,
+            args.stills,
+            args.still_size,
+            args.fps,
+            args.slots,
+            args.burst,
+            replies,
+        )
+    except Exception as e:
+        replies.write(json.dumps({"error": f"Camera failed: {e}"}) + "\n")
+        replies.flush()
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import json
+import os
+import shutil
+
+from lxml import etree
+
+import utils.layout as layout
+import utils.persist as persist
+import utils.pipeline as pipeline
+
+SVG_NS = "http://www.w3.org/2000/svg"
+
+
+# Function to get an SVG's pixel size, reading only its root element if the
+# size wasn't recorded at capture time
+def part_info(svg_file, pixels_per_cm=pipeline.PIXELS_PER_CM):
+    if isinstance(svg_file, dict):
+        return svg_file
+
+    for _, root_svg in etree.iterparse(svg_file, events=("start",), recover=True):
+        width_cm = float(root_svg.get("width").replace("cm", ""))
+        height_cm = float(root_svg.get("height").replace("cm", ""))
+        return {
+            "svg_path": svg_file,
+            "width_px": width_cm * pixels_per_cm,
+            "height_px": height_cm * pixels_per_cm,
+        }
+    raise ValueError(f"{svg_file} is not an SVG file")
+
+
+# Function to load one SVG's content into a group with the given transform,
+# from svg_data if the file hasn't been written yet
+def part_group(svg_path, transform, svg_data=None):
+    # Parse the SVG file using lxml
+    parser = etree.XMLParser(ns_clean=True, recover=True)
+    if svg_data is not None:
+        root_svg = etree.fromstring(svg_data, parser)
+    else:
+        root_svg = etree.parse(svg_path, parser).getroot()
+
+    # Remove namespace prefixes for simplicity
+    for elem in root_svg.iter():
+        if not hasattr(elem.tag, "find"):
+            continue  # It's a comment or similar
+        i = elem.tag.find("}")
+        if i >= 0:
+            elem.tag = elem.tag[i + 1 :]
+
+    # Create a group element with the appropriate placement
+    g_element = etree.Element("g")
+    g_element.set("transform", transform)
+
+    # Append the individual SVG content (excluding the outer <svg> tag)
+    for elem in list(root_svg):
+        g_element.append(elem)
+    return g_element
+
+
+# Function to build the root attributes of a combined sheet
+def sheet_attributes(width_px, height_px, pixels_per_cm):
+    return {
+        "version": "1.1",
+        "width": f"{width_px / pixels_per_cm}cm",
+        "height": f"{height_px / pixels_per_cm}cm",
+        "viewBox": f"0 0 {width_px} {height_px}",
+    }
+
+
+# Function to combine several sized SVGs into a single vertically stacked SVG,
+# streaming one part at a time instead of holding every tree in memory
+def combine_svgs(svg_files, combined_svg_path, pixels_per_cm=pipeline.PIXELS_PER_CM):
+    parts = [part_info(svg_file, pixels_per_cm) for svg_file in svg_files]
+
+    # Total dimensions come from the sizes recorded at capture time
+    max_width_px = max((part["width_px"] for part in parts), default=0)
+    total_height_px = sum(part["height_px"] for part in parts)
+
+    with persist.atomic_path(combined_svg_path) as temp_path:
+        with etree.xmlfile(temp_path, encoding="UTF-8") as xf:
+            xf.write_declaration()
+            with xf.element(
+                "svg",
+                sheet_attributes(max_width_px, total_height_px, pixels_per_cm),
+                nsmap={None: SVG_NS},
+            ):
+                current_y = 0  # Starting Y position in pixels
+                for part in parts:
+                    xf.write(
+                        part_group(part["svg_path"], f"translate(0, {current_y})"),
+                        pretty_print=True,
+                    )
+
+                    # Update the Y position for the next SVG
+                    current_y += part["height_px"]
+
+    return combined_svg_path
+
+
+# Function to place a part on a sheet, turning it 90 degrees if needed
+def placement_transform(placement):
+    if placement["rotated"]:
+        x = placement["x"] + placement["width"]
+        return f"translate({x}, {placement['y']}) rotate(90)"
+    return f"translate({placement['x']}, {placement['y']})"
+
+
+# Function to write one nested sheet of parts
+def write_sheet(sheet_path, sheet, parts, pixels_per_cm=pipeline.PIXELS_PER_CM):
+    with persist.atomic_path(sheet_path) as temp_path:
+        with etree.xmlfile(temp_path, encoding="UTF-8") as xf:
+            xf.write_declaration()
+            with xf.element(
+                "svg",
+                sheet_attributes(sheet["width"], sheet["height"], pixels_per_cm),
+                nsmap={None: SVG_NS},
+            ):
+                for placement in sheet["placements"]:
+                    svg_path = parts[placement["index"]]["svg_path"]
+                    xf.write(
+                        part_group(svg_path, placement_transform(placement)),
+                        pretty_print=True,
+                    )
+    return sheet_path
+
+
+# Function to nest SVGs onto sheets of a fixed size instead of stacking them.
+# Writes combined_svg_path for a single sheet, or one numbered file per sheet,
+# several at once.
+def layout_svgs(
+    svg_files,
+    combined_svg_path,
+    sheet_size_cm,
+    pixels_per_cm=pipeline.PIXELS_PER_CM,
+    margin_cm=0.5,
+    allow_rotation=True,
+    workers=persist.PARALLEL_WRITERS,
+):
+    parts = [part_info(svg_file, pixels_per_cm) for svg_file in svg_files]
+
+    sheets = layout.pack(
+        [(part["width_px"], part["height_px"]) for part in parts],
+        sheet_size_cm[0] * pixels_per_cm,
+        sheet_size_cm[1] * pixels_per_cm,
+        margin_cm * pixels_per_cm,
+        allow_rotation,
+    )
+
+    if len(sheets) == 1:
+        sheet_paths = [combined_svg_path]
+    else:
+        base, ext = os.path.splitext(combined_svg_path)
+        sheet_paths = [f"{base}_sheet_{n}{ext}" for n in range(1, len(sheets) + 1)]
+
+    persist.write_in_parallel(
+        write_sheet,
+        [
+            (sheet_path, sheet, parts, pixels_per_cm)
+            for sheet_path, sheet in zip(sheet_paths, sheets)
+        ],
+        workers,
+    )
+    return sheet_paths, sheets
+
+
+# Function to get the index file written next to the sheets
+def sheet_index_path(combined_svg_path):
+    return f"{os.path.splitext(combined_svg_path)[0]}_index.json"
+
+
+# Function to write an index of which parts went onto which sheet and where,
+# in cm from the sheet's top left corner. extra_paths adds more files per
+# sheet, e.g. {"dxf": [...]}. Paths are relative to the index file.
+def write_sheet_index(
+    index_path,
+    sheet_paths,
+    sheets,
+    svg_files,
+    pixels_per_cm=pipeline.PIXELS_PER_CM,
+    extra_paths=None,
+):
+    parts = [part_info(svg_file, pixels_per_cm) for svg_file in svg_files]
+    directory = os.path.dirname(os.path.abspath(index_path))
+
+    def relative(path):
+        return os.path.relpath(os.path.abspath(path), directory)
+
+    entries = []
+    for n, (sheet_path, sheet) in enumerate(zip(sheet_paths, sheets)):
+        entry = {
+            "sheet": n + 1,
+            "svg": relative(sheet_path),
+            **{kind: relative(paths[n]) for kind, paths in (extra_paths or {}).items()},
+            "width_cm": round(sheet["width"] / pixels_per_cm, 3),
+            "height_cm": round(sheet["height"] / pixels_per_cm, 3),
+            "utilization": round(sheet["utilization"], 4),
+            "parts": [],
+        }
+        for placement in sheet["placements"]:
+            part = parts[placement["index"]]
+            entry["parts"].append(
+                {
+                    **({"id": part["id"]} if "id" in part else {}),
+                    "svg": relative(part["svg_path"]),
+                    "x_cm": round(placement["x"] / pixels_per_cm, 3),
+                    "y_cm": round(placement["y"] / pixels_per_cm, 3),
+                    "width_cm": round(placement["width"] / pixels_per_cm, 3),
+                    "height_cm": round(placement["height"] / pixels_per_cm, 3),
+                    "rotated": placement["rotated"],
+                }
+            )
+        entries.append(entry)
+
+    persist.atomic_write(index_path, json.dumps({"sheets": entries}, indent=2).encode())
+    return index_path
+
+
+# Combined sheet that grows as captures finish, so writing the final
+# document only needs to wrap the groups that are already on disk
+class RunningSheet:
+    def __init__(self, combined_svg_path, pixels_per_cm=pipeline.PIXELS_PER_CM):
+        self.combined_svg_path = combined_svg_path
+        self.parts_path = f"{combined_svg_path}.parts"
+        self.pixels_per_cm = pixels_per_cm
+        self.reset()
+
+    # Function to start an empty sheet, discarding any earlier groups
+    def reset(self):
+        self.svg_paths = []
+        self.max_width_px = 0
+        self.total_height_px = 0
+        if os.path.exists(self.parts_path):
+            os.remove(self.parts_path)
+
+    # Function to append a finished capture below the previous ones
+    def append(self, svg_info, svg_data=None):
+        part = part_info(svg_info, self.pixels_per_cm)
+        g_element = part_group(
+            part["svg_path"], f"translate(0, {self.total_height_px})", svg_data
+        )
+        with open(self.parts_path, "ab") as f:
+            f.write(etree.tostring(g_element, pretty_print=True))
+
+        self.svg_paths.append(part["svg_path"])
+        self.max_width_px = max(self.max_width_px, part["width_px"])
+        self.total_height_px += part["height_px"]
+
+    # Function to write the combined document from the groups so far
+    def write(self):
+        root_svg = etree.Element(
+            "svg",
+            sheet_attributes(
+                self.max_width_px, self.total_height_px, self.pixels_per_cm
+            ),
+            nsmap={None: SVG_NS},
+        )
+        root_svg.text = "\n"
+        header, footer = etree.tostring(root_svg).split(b"\n", 1)
+
+        with persist.atomic_path(self.combined_svg_path) as temp_path:
+            with open(temp_path, "wb") as out:
+                out.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+                out.write(header + b"\n")
+                if os.path.exists(self.parts_path):
+                    with open(self.parts_path, "rb") as parts:
+                        shutil.copyfileobj(parts, out)
+                out.write(footer + b"\n")
+
+        return self.combined_svg_path
@@ -0,0 +1,175 @@
+# DXF export of tool outlines as closed R12 polylines in millimetres, written
+# straight from the contours found in the photo rather than from the traced
+# SVG. DXF has y pointing up, so outlines are flipped from image coordinates.
+# R12 has no header variable for drawing units, so the files don't say they
+# are in mm; import them as millimetres.
+import os
+
+import cv2
+import numpy as np
+
+import utils.persist as persist
+
+LAYER = "OUTLINE"
+HEADER = (
+    "0\nSECTION\n2\nHEADER\n"
+    "9\n$ACADVER\n1\nAC1009\n"
+    "0\nENDSEC\n"
+    "0\nSECTION\n2\nENTITIES\n"
+)
+FOOTER = "0\nENDSEC\n0\nEOF\n"
+
+
+# Function to simplify contours into closed polylines, in image pixels
+def contour_polylines(contours, tolerance_px=0):
+    polylines = []
+    for contour in contours:
+        if tolerance_px > 0:
+            contour = cv2.approxPolyDP(contour, tolerance_px, True)
+        if len(contour) >= 3:
+            polylines.append(contour.reshape(-1, 2).astype(np.float64))
+    return polylines
+
+
+# Function to format one closed polyline as DXF entities
+def polyline_entities(points_mm):
+    # R12 POLYLINEs carry a dummy point; the vertices follow as VERTEXes
+    lines = [f"0\nPOLYLINE\n8\n{LAYER}\n66\n1\n10\n0.0\n20\n0.0\n30\n0.0\n70\n1\n"]
+    for x, y in points_mm:
+        lines.append(f"0\nVERTEX\n8\n{LAYER}\n10\n{x:.3f}\n20\n{y:.3f}\n")
+    lines.append(f"0\nSEQEND\n8\n{LAYER}\n")
+    return "".join(lines)
+
+
+# Function to write one part's outlines, sized in mm, atomically or through
+# a persist.WriteBehind
+def write_part_dxf(
+    dxf_path,
+    polylines,
+    width_px,
+    height_px,
+    pixels_per_cm,
+    writer=None,
+):
+    mm_per_px = 10 / pixels_per_cm
+    entities = []
+    for points in polylines:
+        # Flip so the part isn't upside down
+        points_mm = np.column_stack(
+            (points[:, 0] * mm_per_px, (height_px - points[:, 1]) * mm_per_px)
+        )
+        entities.append(polyline_entities(points_mm))
+    data = HEADER + "".join(entities) + FOOTER
+    persist.write_file(dxf_path, data.encode("ascii"), writer)
+    return dxf_path
+
+
+# Function to read back the polylines of a DXF written by write_part_dxf,
+# from dxf_data if the file hasn't been written yet. Returns arrays in mm.
+def read_polylines(dxf_path, dxf_data=None):
+    if dxf_data is None:
+        with open(dxf_path, "rb") as f:
+            dxf_data = f.read()
+    values = dxf_data.decode("ascii").split("\n")
+
+    polylines = []
+    points = None
+    in_vertex = False  # Skips the POLYLINE's own dummy point
+    x = None
+    for code, value in zip(values[0::2], values[1::2]):
+        code = code.strip()
+        value = value.strip()
+        if code == "0":
+            in_vertex = value == "VERTEX" and points is not None
+            if value == "POLYLINE":
+                points = []
+            elif value == "SEQEND" and points is not None:
+                polylines.append(np.array(points, dtype=np.float64).reshape(-1, 2))
+                points = None
+        elif in_vertex and code == "10":
+            x = float(value)
+        elif in_vertex and code == "20":
+            points.append((x, float(value)))
+    return polylines
+
+
+# Function to write one sheet of parts, with the placements used for the
+# combined SVG (see combine.placement_transform). Parts are read and
+# written one at a time, so the sheet is never held in memory.
+def write_sheet(dxf_path, sheet, parts, pixels_per_cm):
+    mm_per_px = 10 / pixels_per_cm
+    sheet_height_mm = sheet["height"] * mm_per_px
+
+    with persist.atomic_path(dxf_path) as temp_path:
+        with open(temp_path, "w") as f:
+            f.write(HEADER)
+            for placement in sheet["placements"]:
+                part = parts[placement["index"]]
+                x_mm = placement["x"] * mm_per_px
+                y_mm = placement["y"] * mm_per_px
+                part_height_mm = part["height_px"] * mm_per_px
+
+                for points in read_polylines(part["dxf_path"]):
+                    # Back to y pointing down within the part
+                    px, py = points[:, 0], part_height_mm - points[:, 1]
+                    if placement["rotated"]:
+                        # Turned 90 degrees clockwise, like rotate(90) in SVG
+                        px, py = part_height_mm - py, px
+                    sheet_x = x_mm + px
+                    sheet_y = sheet_height_mm - (y_mm + py)
+                    f.write(polyline_entities(np.column_stack((sheet_x, sheet_y))))
+            f.write(FOOTER)
+    return dxf_path
+
+
+# Function to get the sheet that combine.combine_svgs stacks parts onto
+def stacked_sheet(parts):
+    placements = []
+    y = 0
+    for index, part in enumerate(parts):
+        placements.append(
+            {
+                "index": index,
+                "x": 0,
+                "y": y,
+                "width": part["width_px"],
+                "height": part["height_px"],
+                "rotated": False,
+            }
+        )
+        y += part["height_px"]
+    return {
+        "width": max((part["width_px"] for part in parts), default=0),
+        "height": y,
+        "placements": placements,
+    }
+
+
+# Function to write the combined DXF with the parts stacked like the
+# combined SVG, or one DXF per sheet if the parts were nested onto sheets
+# by combine.layout_svgs, several at once. Parts need a "dxf_path".
+def combine_dxfs(
+    parts,
+    combined_dxf_path,
+    pixels_per_cm,
+    sheets=None,
+    workers=persist.PARALLEL_WRITERS,
+):
+    if sheets is None:
+        sheets = [stacked_sheet(parts)]
+
+    if len(sheets) == 1:
+        dxf_paths = [combined_dxf_path]
+    else:
+        base, ext = os.path.splitext(combined_dxf_path)
+        dxf_paths = [f"{base}_sheet_{n}{ext}" for n in range(1, len(sheets) + 1)]
+
+    persist.write_in_parallel(
+        write_sheet,
+        [
+            (dxf_path, sheet, parts, pixels_per_cm)
+            for dxf_path, sheet in zip(dxf_paths, sheets)
+        ],
+        workers,
+    )
+    return dxf_paths
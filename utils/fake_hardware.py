@@ -0,0 +1,213 @@
+# Stand-in camera and GPIO backends so the app, tools and benchmarks can run
+# on a machine without a Raspberry Pi camera or GPIO header.
+import glob
+import os
+import sys
+import time
+import types
+
+import cv2
+import numpy as np
+
+SAMPLE_FRAMES = sorted(
+    glob.glob(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "captured_image_*.jpg")
+    )
+)
+
+
+# Camera that serves the sample frames (or blank frames) in a loop, resized
+# to whatever each stream is configured as
+class FakePicamera2:
+    def __init__(self, frames=None):
+        if frames is None:
+            frames = [cv2.imread(path) for path in SAMPLE_FRAMES]
+        self.frames = [frame for frame in frames if frame is not None] or [
+            np.full((480, 640, 3), 255, dtype=np.uint8)
+        ]
+        self.sensor_resolution = (2028, 1520)
+        self.streams = {"main": {"size": (640, 480), "format": "RGB888"}}
+        self.controls = {}
+        self.started = False
+        self.frame_index = 0
+        self.next_frame_time = 0.0
+
+    def _configuration(self, main=None, lores=None, controls=None, **kwargs):
+        config = {
+            "main": {"size": (640, 480), "format": "RGB888"},
+            "controls": dict(controls or {}),
+        }
+        config["main"].update(main or {})
+        if lores:
+            config["lores"] = {"size": (320, 240), "format": "YUV420"}
+            config["lores"].update(lores)
+        return config
+
+    create_still_configuration = _configuration
+    create_preview_configuration = _configuration
+    create_video_configuration = _configuration
+
+    def configure(self, config):
+        self.streams = {
+            name: dict(config[name]) for name in ("main", "lores") if name in config
+        }
+        self.controls = dict(config.get("controls", {}))
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.started = False
+
+    def _next_frame(self):
+        frame = self.frames[self.frame_index % len(self.frames)]
+        self.frame_index += 1
+        return frame
+
+    # Function to return the next frame in the format of the given stream
+    def capture_array(self, name="main"):
+        return self._stream_array(self._next_frame(), name)
+
+    # Function to get one request holding the same frame for every stream.
+    # Like the real camera, this waits for the next frame at the configured
+    # FrameRate.
+    def capture_request(self):
+        frame_duration = 1 / self.controls.get("FrameRate", 30)
+        now = time.monotonic()
+        if self.next_frame_time > now:
+            time.sleep(self.next_frame_time - now)
+            now = self.next_frame_time
+        self.next_frame_time = now + frame_duration
+        return FakeCompletedRequest(self, self._next_frame(), now)
+
+    # Function to convert a sample frame to the size and format of a stream
+    def _stream_array(self, frame, name):
+        stream = self.streams.get(name, self.streams["main"])
+        if frame.shape[1::-1] != tuple(stream["size"]):
+            frame = cv2.resize(
+                frame, tuple(stream["size"]), interpolation=cv2.INTER_AREA
+            )
+        else:
+            frame = frame.copy()  # The real capture_array returns a new array
+        if stream.get("format") == "YUV420":
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+        return frame
+
+    def switch_mode(self, camera_config):
+        self.configure(camera_config)
+
+    # Function to capture one frame in another configuration, e.g. a
+    # full-resolution still, then go back to the running configuration
+    def switch_mode_and_capture_array(self, camera_config, name="main"):
+        streams = self.streams
+        self.configure(camera_config)
+        try:
+            return self.capture_array(name)
+        finally:
+            self.streams = streams
+
+    def capture_file(self, path, name="main"):
+        cv2.imwrite(path, self.capture_array(name))
+
+
+# Request returned by FakePicamera2.capture_request
+class FakeCompletedRequest:
+    def __init__(self, camera, frame, timestamp):
+        self.camera = camera
+        self.frame = frame
+        self.metadata = {"SensorTimestamp": int(timestamp * 1e9)}
+
+    def get_metadata(self):
+        return self.metadata
+
+    def make_array(self, name):
+        return self.camera._stream_array(self.frame, name)
+
+    def release(self):
+        self.frame = None
+
+
+# Function to build a module with the parts of RPi.GPIO the app uses.
+# Pins read HIGH (released) unless set with press()/release().
+def make_fake_gpio():
+    gpio = types.ModuleType("RPi.GPIO")
+    gpio.BCM = "BCM"
+    gpio.IN = "IN"
+    gpio.PUD_UP = "PUD_UP"
+    gpio.LOW = 0
+    gpio.HIGH = 1
+    gpio.RISING = "RISING"
+    gpio.FALLING = "FALLING"
+    gpio.BOTH = "BOTH"
+    gpio.levels = {}
+    gpio.callbacks = {}
+
+    def setmode(mode):
+        gpio.mode = mode
+
+    def setup(pin, direction, pull_up_down=None):
+        gpio.levels.setdefault(pin, gpio.HIGH)
+
+    def input(pin):
+        return gpio.levels.get(pin, gpio.HIGH)
+
+    def add_event_detect(pin, edge, callback=None, bouncetime=None):
+        if pin in gpio.callbacks:
+            raise RuntimeError(
+                "Conflicting edge detection already enabled for this GPIO channel"
+            )
+        gpio.callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(pin):
+        gpio.callbacks.pop(pin, None)
+
+    # Function to change a pin's level and run its edge callback, if any
+    def _set_level(pin, level):
+        previous = gpio.levels.get(pin, gpio.HIGH)
+        gpio.levels[pin] = level
+        edge, callback = gpio.callbacks.get(pin, (None, None))
+        if callback is None or previous == level:
+            return
+        if edge == gpio.BOTH or edge == (
+            gpio.FALLING if level == gpio.LOW else gpio.RISING
+        ):
+            callback(pin)
+
+    def press(pin):
+        _set_level(pin, gpio.LOW)
+
+    def release(pin):
+        _set_level(pin, gpio.HIGH)
+
+    def cleanup():
+        gpio.levels.clear()
+        gpio.callbacks.clear()
+
+    gpio.setmode = setmode
+    gpio.setup = setup
+    gpio.input = input
+    gpio.add_event_detect = add_event_detect
+    gpio.remove_event_detect = remove_event_detect
+    gpio.press = press
+    gpio.release = release
+    gpio.cleanup = cleanup
+    return gpio
+
+
+# Function to make "from picamera2 import Picamera2" and "import RPi.GPIO"
+# load the stand-ins, unless the real modules are already imported
+def install():
+    if "picamera2" not in sys.modules:
+        picamera2 = types.ModuleType("picamera2")
+        picamera2.Picamera2 = FakePicamera2
+        sys.modules["picamera2"] = picamera2
+
+    if "RPi.GPIO" not in sys.modules:
+        gpio = make_fake_gpio()
+        rpi = types.ModuleType("RPi")
+        rpi.GPIO = gpio
+        sys.modules["RPi"] = rpi
+        sys.modules["RPi.GPIO"] = gpio
@@ -0,0 +1,66 @@
+import queue
+import threading
+
+
+# Bounded queue of background jobs run by a fixed set of worker threads.
+# Results are collected with poll() from the thread that owns the GUI.
+class JobQueue:
+    def __init__(self, max_pending=4, workers=2):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # Function to add a job, returning False if the queue is already full
+    def submit(self, tag, func, *args, **kwargs):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+        self._jobs.put((tag, func, args, kwargs))
+        return True
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            tag, func, args, kwargs = job
+            try:
+                self._results.put((tag, func(*args, **kwargs), None))
+            except Exception as e:
+                self._results.put((tag, None, e))
+
+    # Function to collect finished jobs as (tag, result, error) without blocking
+    def poll(self):
+        finished = []
+        while True:
+            try:
+                tag, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self.pending -= 1
+                if error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            finished.append((tag, result, error))
+        return finished
+
+    # Function to stop the workers, optionally waiting for queued jobs to finish
+    def shutdown(self, wait=True):
+        for _ in self._threads:
+            self._jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,157 @@
+# Skyline bin packing of part bounding boxes onto fixed-size sheets.
+# All sizes are in the same unit (the combine step uses pixels).
+
+
+# One sheet being filled; the skyline is a list of [x, y, width] segments
+# covering the usable width, y being the height already used at that x
+class _Sheet:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [[0, 0, width]]
+        self.placements = []
+        self.used_area = 0
+
+    # Function to find the lowest position for a w x h box, or None if it won't fit
+    def find_position(self, w, h):
+        best = None
+        for i, (x, _, _) in enumerate(self.skyline):
+            if x + w > self.width:
+                break
+
+            # The box rests on the highest segment it spans
+            y = 0
+            remaining = w
+            j = i
+            while remaining > 1e-9 and j < len(self.skyline):
+                y = max(y, self.skyline[j][1])
+                remaining -= self.skyline[j][2]
+                j += 1
+            if y + h > self.height:
+                continue
+
+            if best is None or (y + h, x) < (best[1] + h, best[0]):
+                best = (x, y)
+        return best
+
+    # Function to raise the skyline under a box placed at a segment start
+    def place(self, x, y, w, h):
+        right = x + w
+        new_segment = [x, y + h, w]
+
+        skyline = []
+        for seg_x, seg_y, seg_w in self.skyline:
+            seg_right = seg_x + seg_w
+            if seg_right <= x:
+                skyline.append([seg_x, seg_y, seg_w])
+                continue
+            if new_segment is not None:
+                skyline.append(new_segment)
+                new_segment = None
+            # Keep the part of a covered segment that sticks out to the right
+            if seg_right > right:
+                skyline.append(
+                    [max(seg_x, right), seg_y, seg_right - max(seg_x, right)]
+                )
+
+        # Merge neighbouring segments at the same height
+        merged = [skyline[0]]
+        for segment in skyline[1:]:
+            if segment[1] == merged[-1][1]:
+                merged[-1][2] += segment[2]
+            else:
+                merged.append(segment)
+        self.skyline = merged
+
+
+# Function to pack (width, height) boxes onto as few sheets as possible.
+# Returns one dict per sheet with its placements and utilization.
+def pack(sizes, sheet_width, sheet_height, margin=0, allow_rotation=True):
+    # Each box is grown by the margin, and the sheet shrunk by it, so every
+    # part keeps a margin to its neighbours and to the sheet edges
+    usable_width = sheet_width - margin
+    usable_height = sheet_height - margin
+
+    # Place tall parts first, the skyline fills best that way
+    order = sorted(
+        range(len(sizes)), key=lambda i: (max(sizes[i]), min(sizes[i])), reverse=True
+    )
+
+    sheets = []
+    for index in order:
+        width, height = sizes[index]
+        orientations = [(width + margin, height + margin, False)]
+        if allow_rotation and width != height:
+            orientations.append((height + margin, width + margin, True))
+
+        placed = False
+        for sheet in sheets:
+            best = None
+            for w, h, rotated in orientations:
+                position = sheet.find_position(w, h)
+                if position and (
+                    best is None or position[1] + h < best[1][1] + best[2]
+                ):
+                    best = ((w, rotated), position, h)
+            if best:
+                (w, rotated), (x, y), h = best
+                sheet.place(x, y, w, h)
+                sheet.placements.append(
+                    _placement(index, x, y, width, height, rotated, margin)
+                )
+                sheet.used_area += width * height
+                placed = True
+                break
+        if placed:
+            continue
+
+        # Start a new sheet; a part bigger than the sheet gets one of its own
+        sheet = _Sheet(usable_width, usable_height)
+        fitting = [
+            o for o in orientations if o[0] <= usable_width and o[1] <= usable_height
+        ]
+        if fitting:
+            w, h, rotated = min(fitting, key=lambda o: o[1])
+            sheet.place(0, 0, w, h)
+        else:
+            rotated = False
+            sheet.width = max(usable_width, width + margin)
+            sheet.height = max(usable_height, height + margin)
+            sheet.skyline = [[0, sheet.height, sheet.width]]
+        sheet.placements.append(_placement(index, 0, 0, width, height, rotated, margin))
+        sheet.used_area += width * height
+        sheets.append(sheet)
+
+    return [
+        {
+            "width": sheet.width + margin,
+            "height": sheet.height + margin,
+            "placements": sheet.placements,
+            "utilization": sheet.used_area
+            / ((sheet.width + margin) * (sheet.height + margin)),
+        }
+        for sheet in sheets
+    ]
+
+
+# Function to describe where a part goes, offset by the sheet margin
+def _placement(index, x, y, width, height, rotated, margin):
+    return {
+        "index": index,
+        "x": x + margin,
+        "y": y + margin,
+        "width": height if rotated else width,
+        "height": width if rotated else height,
+        "rotated": rotated,
+    }
+
+
+# Function to report how much of the sheets the parts cover
+def total_utilization(sheets):
+    sheet_area = sum(sheet["width"] * sheet["height"] for sheet in sheets)
+    if not sheet_area:
+        return 0.0
+    return (
+        sum(sheet["utilization"] * sheet["width"] * sheet["height"] for sheet in sheets)
+        / sheet_area
+    )
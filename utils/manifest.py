@@ -0,0 +1,166 @@
+import json
+import os
+import re
+import threading
+import time
+
+import utils.combine as combine
+
+
+# Append-only index of a session's captures, one JSON record per line in the
+# output directory. Resuming a session reads it instead of scanning photos/
+# and svgs/, and capture ids keep counting up from the highest one recorded,
+# so deleted files never lead to names being reused.
+#
+# Records are {"type": "capture", "id", "photo", "svg", "dxf", ...} for each
+# processed capture and {"type": "combine", "ids", "sheets"} each time the
+# captures so far were combined, plus {"type": "reserve", "id"} for numbers
+# that are taken without a capture record. Paths are relative to the output
+# directory.
+class SessionManifest:
+    def __init__(self, output_directory, filename="manifest.jsonl"):
+        self.output_directory = output_directory
+        self.path = os.path.join(output_directory, filename)
+        self.captures = {}  # id -> latest capture record
+        self.combined_ids = set()
+        self.uncombined_ids = set()  # Recorded captures not combined yet
+        self.last_id = 0
+        self._torn = False  # The last line was cut short
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+
+        self._torn = bool(lines) and not lines[-1].endswith("\n")
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by a crash or power cut
+            if record.get("type") == "capture":
+                self.captures[record["id"]] = record
+                self.last_id = max(self.last_id, record["id"])
+            elif record.get("type") == "reserve":
+                self.last_id = max(self.last_id, record["id"])
+            elif record.get("type") == "combine":
+                self.combined_ids.update(record["ids"])
+        self.uncombined_ids = set(self.captures) - self.combined_ids
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _append(self, record):
+        line = json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), **record})
+        if self._torn:
+            line = "\n" + line  # Don't run on from a half-written line
+            self._torn = False
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    # Function to get the next capture id. Ids are only written with the
+    # finished capture, so one that never finished may be handed out again
+    # after a restart, overwriting whatever it left behind.
+    def new_id(self):
+        with self._lock:
+            self.last_id += 1
+            return self.last_id
+
+    # Function to record a processed capture. Paths may be absolute.
+    def record_capture(self, capture_id, svg_info, photo_path=None, **details):
+        record = {
+            "type": "capture",
+            "id": capture_id,
+            "photo": self._relative(photo_path),
+            "svg": self._relative(svg_info["svg_path"]),
+            "dxf": self._relative(svg_info.get("dxf_path")),
+            "width_px": svg_info["width_px"],
+            "height_px": svg_info["height_px"],
+            **details,
+        }
+        with self._lock:
+            self._append(record)
+            self.captures[capture_id] = record
+            if capture_id not in self.combined_ids:
+                self.uncombined_ids.add(capture_id)
+            self.last_id = max(self.last_id, capture_id)
+
+    # Function to record that these captures went into a combined sheet
+    def record_combine(self, capture_ids, sheet_paths):
+        with self._lock:
+            self._append(
+                {
+                    "type": "combine",
+                    "ids": list(capture_ids),
+                    "sheets": [self._relative(path) for path in sheet_paths],
+                }
+            )
+            self.combined_ids.update(capture_ids)
+            self.uncombined_ids.difference_update(capture_ids)
+
+    # Function to get the svg_info dict of a recorded capture, or None if its
+    # SVG was lost before it was written
+    def svg_info(self, capture_id):
+        record = self.captures[capture_id]
+        svg_path = os.path.join(self.output_directory, record["svg"])
+        if not os.path.exists(svg_path):
+            return None
+        svg_info = {
+            "id": capture_id,
+            "svg_path": svg_path,
+            "width_px": record["width_px"],
+            "height_px": record["height_px"],
+        }
+        if record.get("dxf"):
+            dxf_path = os.path.join(self.output_directory, record["dxf"])
+            if os.path.exists(dxf_path):
+                svg_info["dxf_path"] = dxf_path
+        return svg_info
+
+    # Function to get svg_info dicts for the captures not combined yet whose
+    # SVG exists, in capture order
+    def pending_svg_files(self):
+        svg_files = []
+        for capture_id in sorted(self.uncombined_ids):
+            svg_info = self.svg_info(capture_id)
+            if svg_info is not None:
+                svg_files.append(svg_info)
+        return svg_files
+
+    # Function to add the numbered SVGs of a session made before manifests
+    # existed, reading their sizes once
+    def import_existing(self, pixels_per_cm):
+        svgs_dir = os.path.join(self.output_directory, "svgs")
+        if not os.path.isdir(svgs_dir):
+            return 0
+
+        imported = 0
+        for name in os.listdir(svgs_dir):
+            match = re.fullmatch(r"output_image_(\d+)\.svg", name)
+            if not match:
+                continue
+            svg_info = combine.part_info(os.path.join(svgs_dir, name), pixels_per_cm)
+            self.record_capture(int(match.group(1)), svg_info, imported=True)
+            imported += 1
+
+        # Photos may have been kept without an SVG, don't reuse their numbers
+        photos_dir = os.path.join(self.output_directory, "photos")
+        if os.path.isdir(photos_dir):
+            for name in os.listdir(photos_dir):
+                match = re.match(r"captured_image_(\d+)", name)
+                if match and int(match.group(1)) > self.last_id:
+                    with self._lock:
+                        self.last_id = int(match.group(1))
+                        self._append({"type": "reserve", "id": self.last_id})
+        return imported
+
+    def _relative(self, path):
+        if path is None:
+            return None
+        return os.path.relpath(path, self.output_directory)
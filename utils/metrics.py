@@ -0,0 +1,88 @@
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+
+import utils.persist as persist
+
+
+# Collects how long each named stage of one operation took, in milliseconds
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    # Context manager timing one stage; repeated stages add up
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    def total_ms(self):
+        return sum(self.stages.values())
+
+
+# Function to get the nearest-rank percentile of a list of numbers
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[
+        min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    ]
+
+
+# Appends one JSON record per line to a run's metrics file and keeps the
+# stage timings in memory for the summary
+class MetricsLog:
+    def __init__(self, output_directory, filename="metrics.jsonl"):
+        self.output_directory = output_directory
+        self.path = os.path.join(output_directory, filename)
+        self._lock = threading.Lock()
+        self._timings = {}
+
+    # Function to append a record, e.g. {"type": "capture", "stages": {...}}
+    def append(self, record):
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), **record}
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+            for stage, ms in record.get("stages", {}).items():
+                key = (record.get("type", ""), stage)
+                self._timings.setdefault(key, []).append(ms)
+
+    # Function to get p50/p95 per stage of everything logged so far
+    def summary(self):
+        with self._lock:
+            timings = {key: list(values) for key, values in self._timings.items()}
+        return {
+            f"{record_type}.{stage}": {
+                "count": len(values),
+                "p50_ms": percentile(values, 0.50),
+                "p95_ms": percentile(values, 0.95),
+            }
+            for (record_type, stage), values in timings.items()
+        }
+
+    # Function to print the summary and save it next to the metrics file
+    def write_summary(self, filename="metrics_summary.json"):
+        summary = self.summary()
+        if not summary:
+            return summary
+
+        print(f"{'stage':<30}{'count':>7}{'p50 ms':>12}{'p95 ms':>12}")
+        for stage, stats in summary.items():
+            print(
+                f"{stage:<30}{stats['count']:>7}"
+                f"{stats['p50_ms']:>12.1f}{stats['p95_ms']:>12.1f}"
+            )
+
+        summary_path = os.path.join(self.output_directory, filename)
+        persist.atomic_write(summary_path, json.dumps(summary, indent=2).encode())
+        return summary
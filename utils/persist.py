@@ -0,0 +1,136 @@
+import contextlib
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PARALLEL_WRITERS = 4
+
+
+# Function to fsync a directory so a rename in it survives a power cut
+def _sync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # Not supported on this platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Context manager yielding a temporary path next to path, which replaces path
+# only once everything written to it is on disk
+@contextlib.contextmanager
+def atomic_path(path, sync_directory=True):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield temp_path
+        with open(temp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if sync_directory:
+        _sync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+# Function to write bytes to path atomically
+def atomic_write(path, data, sync_directory=True):
+    with atomic_path(path, sync_directory) as temp_path:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+
+
+# Function to call write(*args) for each tuple of args on a pool of threads,
+# e.g. to write the sheets of a combined session side by side. Writers that
+# spend their time in lxml, numpy or fsync let go of the GIL, so they
+# overlap; a process pool would have to fork the GUI.
+def write_in_parallel(write, jobs, workers=PARALLEL_WRITERS):
+    if len(jobs) <= 1 or workers == 1:
+        return [write(*args) for args in jobs]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(write, *args) for args in jobs]
+        return [future.result() for future in futures]
+
+
+# Function to write through a WriteBehind if given, or straight away if not
+def write_file(path, data, writer=None):
+    if writer is None:
+        atomic_write(path, data)
+    else:
+        writer.write(path, data)
+
+
+# Stages file contents in RAM and writes them from a background thread,
+# in batches, each file replaced atomically. write() blocks once
+# max_backlog files are waiting, so a slow card slows producers down
+# instead of using up memory.
+class WriteBehind:
+    def __init__(self, max_backlog=32):
+        self._queue = queue.Queue(maxsize=max_backlog)
+        self._staged = {}
+        self._lock = threading.Lock()
+        self.errors = []
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    # Function to queue a file for writing
+    def write(self, path, data):
+        with self._lock:
+            self._staged[path] = data
+        self._queue.put((path, data))
+
+    # Function to get the contents of a file that hasn't been written yet
+    def read(self, path):
+        with self._lock:
+            return self._staged.get(path)
+
+    def _writer(self):
+        while True:
+            batch = [self._queue.get()]
+            # Take everything else that is already waiting as one batch
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            directories = set()
+            stop = False
+            for item in batch:
+                if item is None:
+                    stop = True
+                    continue
+                path, data = item
+                try:
+                    atomic_write(path, data, sync_directory=False)
+                    directories.add(os.path.dirname(os.path.abspath(path)))
+                except OSError as e:
+                    print(f"Could not write {path}: {e}")
+                    self.errors.append((path, e))
+                with self._lock:
+                    # Keep newer data staged if the path was written again
+                    if self._staged.get(path) is data:
+                        del self._staged[path]
+
+            # One directory sync per batch makes all the renames durable
+            for directory in directories:
+                _sync_directory(directory)
+
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                break
+
+    # Function to wait until everything queued so far is on disk
+    def flush(self):
+        self._queue.join()
+
+    # Function to flush and stop the writer thread
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
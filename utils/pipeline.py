@@ -0,0 +1,183 @@
+import cv2
+import numpy as np
+
+import utils.dxf as dxf
+import utils.metrics as metrics
+import utils.persist as persist
+import utils.simplify as simplify
+import utils.trace as trace
+import utils.undistort as undistort
+
+# Default scale of the capture setup (calculated with reference_calibration.py)
+PIXELS_PER_CM = 24.16
+
+# Traced outlines are simplified so no point moves by more than this many mm;
+# 0 keeps potrace's output as it is
+SIMPLIFY_TOLERANCE_MM = 0.25
+
+# Gray level below which a pixel counts as part of the tool
+THRESHOLD_LEVEL = 128
+
+
+# Function to crop an image to the crop zone, clamped to the image dimensions
+def crop_image(image, crop_coords):
+    x0, y0, x1, y1 = map(int, crop_coords)
+    # Ensure coordinates are within the image dimensions
+    x0 = max(0, min(x0, image.shape[1]))
+    x1 = max(0, min(x1, image.shape[1]))
+    y0 = max(0, min(y0, image.shape[0]))
+    y1 = max(0, min(y1, image.shape[0]))
+    return image[y0:y1, x0:x1]
+
+
+# Function to map a crop zone between resolutions, e.g. from the 640x480
+# canvas to a full-sensor still
+def scale_crop(crop_coords, from_size, to_size):
+    sx = to_size[0] / from_size[0]
+    sy = to_size[1] / from_size[1]
+    x0, y0, x1, y1 = crop_coords
+    return (
+        int(round(x0 * sx)),
+        int(round(y0 * sy)),
+        int(round(x1 * sx)),
+        int(round(y1 * sy)),
+    )
+
+
+# Function to save a photo as base_path plus the format's extension, or not
+# at all if photo_format is None
+def save_photo(image, base_path, photo_format="jpg", writer=None):
+    if not photo_format:
+        return None
+    photo_path = f"{base_path}.{photo_format}"
+    ok, encoded = cv2.imencode(f".{photo_format}", image)
+    if not ok:
+        raise ValueError(f"Could not encode photo as {photo_format}")
+    persist.write_file(photo_path, encoded.tobytes(), writer)
+    return photo_path
+
+
+# Function to threshold a photo so the tool is white on black
+def threshold_image(image):
+    # Convert the image to grayscale
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    # Apply a binary threshold to separate the object from the background
+    _, binary = cv2.threshold(gray, THRESHOLD_LEVEL, 255, cv2.THRESH_BINARY_INV)
+    return binary
+
+
+# Function to find the external contours of the object
+def find_outline_contours(binary):
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+# Function to draw contours as a black-on-white outline mask
+def draw_outline_mask(contours, shape):
+    # Create a mask for the object outline
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    cv2.drawContours(mask, contours, -1, (255), thickness=2)
+
+    # Invert the mask to have the outline as black on white
+    return cv2.bitwise_not(mask)
+
+
+# Function to run the whole photo -> sized SVG pipeline on one image. Pass a
+# metrics.StageTimer as timer to record how long each stage takes, and the
+# resolution mtx was calibrated at as calibration_size if it may differ from
+# the image's. Only the crop zone is undistorted, thresholded and traced.
+# The returned svg_info includes the outline's node count before and after
+# simplification. With a trace_cache.TraceCache, outlines that were traced
+# before with the same settings are not traced again. Pass dxf_path to also
+# write the outline as DXF polylines, straight from the contours.
+def process_image(
+    image,
+    svg_path,
+    mtx=None,
+    dist=None,
+    crop_coords=None,
+    pixels_per_cm=PIXELS_PER_CM,
+    writer=None,
+    timer=None,
+    calibration_size=None,
+    simplify_tolerance_mm=SIMPLIFY_TOLERANCE_MM,
+    trace_cache=None,
+    dxf_path=None,
+):
+    timer = timer or metrics.StageTimer()
+
+    # undistort using the cached remap tables and crop to the valid ROI,
+    # remapping only the crop zone if there is one
+    if mtx is not None and dist is not None:
+        h, w = image.shape[:2]
+        if calibration_size and tuple(calibration_size) != (w, h):
+            mtx = undistort.scale_camera_matrix(mtx, calibration_size, (w, h))
+        with timer.stage("undistort"):
+            if crop_coords:
+                image = undistort.undistort_crop(image, mtx, dist, crop_coords)
+                crop_coords = None
+            else:
+                image = undistort.undistort(image, mtx, dist)
+
+    # If a crop zone is given, crop the image
+    if crop_coords:
+        with timer.stage("crop"):
+            image = crop_image(image, crop_coords)
+
+    with timer.stage("outline"):
+        contours = find_outline_contours(threshold_image(image))
+        mask_inv = draw_outline_mask(contours, image.shape)
+
+    tolerance_px = simplify_tolerance_mm / 10 * pixels_per_cm
+
+    # Reuse the path data if this exact outline was traced before
+    cached = None
+    if trace_cache is not None:
+        with timer.stage("trace_cache"):
+            cache_key = trace_cache.key(
+                mask_inv, tolerance_px=tolerance_px, mtx=mtx, dist=dist
+            )
+            cached = trace_cache.get(cache_key)
+
+    if cached is not None:
+        traced = {"transform": cached["transform"], "paths": cached["paths"]}
+        nodes_before, nodes_after = cached["nodes_before"], cached["nodes_after"]
+    else:
+        # Trace in memory and write the SVG once, already sized
+        with timer.stage("trace"):
+            traced = trace.trace_mask(mask_inv)
+
+        # Drop the nodes the cut doesn't need, with the tolerance in pixels
+        with timer.stage("simplify"):
+            nodes_before = simplify.count_nodes(traced)
+            traced = simplify.simplify_traced(traced, tolerance_px)
+            nodes_after = simplify.count_nodes(traced)
+
+        if trace_cache is not None:
+            trace_cache.put(
+                cache_key,
+                {**traced, "nodes_before": nodes_before, "nodes_after": nodes_after},
+            )
+
+    height_px, width_px = image.shape[:2]
+    with timer.stage("svg_write"):
+        trace.write_svg(svg_path, traced, width_px, height_px, pixels_per_cm, writer)
+
+    svg_info = {
+        "svg_path": svg_path,
+        "width_px": width_px,
+        "height_px": height_px,
+        "nodes": {"before": nodes_before, "after": nodes_after},
+        "trace_cached": cached is not None,
+    }
+
+    if dxf_path:
+        with timer.stage("dxf_write"):
+            polylines = dxf.contour_polylines(contours, tolerance_px)
+            dxf.write_part_dxf(
+                dxf_path, polylines, width_px, height_px, pixels_per_cm, writer
+            )
+        svg_info["dxf_path"] = dxf_path
+
+    return image, svg_info
@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+
+import utils.pipeline as pipeline
+
+
+# Renders low-res YUV420 camera frames into a canvas-sized RGB buffer,
+# reusing the same NumPy buffers for every frame
+class PreviewRenderer:
+    def __init__(self, preview_size=(320, 240), canvas_size=(640, 480)):
+        self.preview_size = preview_size
+        self.canvas_size = canvas_size
+        self.canvas = np.zeros((canvas_size[1], canvas_size[0], 3), dtype=np.uint8)
+        self._rgb = None
+
+    # Function to crop a preview-sized frame to a crop zone given in canvas
+    # pixels, or leave it whole if the zone is empty
+    def _crop(self, frame, crop_coords):
+        if not crop_coords:
+            return frame
+        scale_x = self.preview_size[0] / self.canvas_size[0]
+        scale_y = self.preview_size[1] / self.canvas_size[1]
+        x0, y0, x1, y1 = crop_coords
+        cropped = pipeline.crop_image(
+            frame, (x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y)
+        )
+        return cropped if cropped.size else frame
+
+    # Function to get the grayscale crop zone of a frame without converting
+    # it; the Y plane of a YUV420 frame is its first rows
+    def luma(self, yuv, crop_coords=None):
+        width, height = self.preview_size
+        return self._crop(yuv[:height, :width], crop_coords)
+
+    # Function to convert, crop and resize a frame into the canvas buffer
+    def render(self, yuv, crop_coords=None):
+        # The lores buffer may be padded to the row stride
+        stride_height, stride = yuv.shape[:2]
+        if self._rgb is None or self._rgb.shape[:2] != (stride_height * 2 // 3, stride):
+            self._rgb = np.empty((stride_height * 2 // 3, stride, 3), dtype=np.uint8)
+        cv2.cvtColor(yuv, cv2.COLOR_YUV420p2RGB, dst=self._rgb)
+
+        width, height = self.preview_size
+        frame = self._crop(self._rgb[:height, :width], crop_coords)
+
+        # Resize the frame to fit the canvas
+        cv2.resize(
+            frame, self.canvas_size, dst=self.canvas, interpolation=cv2.INTER_LINEAR
+        )
+        return self.canvas
+
+
+# Draws the outlines a capture would trace onto the preview, found with the
+# capture's threshold on a shrunken grayscale copy of the crop zone. When
+# preview frames take too long, outlines are only found on every
+# (skip + 1)th frame and the last ones are drawn in between.
+class OutlineOverlay:
+    def __init__(
+        self,
+        canvas_size=(640, 480),
+        target_fps=15,
+        work_width=160,
+        max_skip=4,
+        color=(0, 255, 0),
+    ):
+        self.canvas_size = canvas_size
+        self.budget_ms = 1000 / target_fps
+        self.work_width = work_width
+        self.max_skip = max_skip
+        self.color = color
+        self.skip = 0
+        self._countdown = 0
+        self._small = None
+        self._binary = None
+        self._outlines = []  # In canvas pixels
+
+    # Function to find the outlines in a grayscale crop zone, unless this
+    # frame is skipped. Returns whether they were updated.
+    def update(self, gray):
+        if self._countdown > 0:
+            self._countdown -= 1
+            return False
+        self._countdown = self.skip
+        if gray.size == 0:
+            self._outlines = []
+            return True
+
+        width = min(self.work_width, gray.shape[1])
+        height = max(1, round(gray.shape[0] * width / gray.shape[1]))
+        if self._small is None or self._small.shape != (height, width):
+            self._small = np.empty((height, width), dtype=np.uint8)
+            self._binary = np.empty((height, width), dtype=np.uint8)
+        cv2.resize(gray, (width, height), dst=self._small, interpolation=cv2.INTER_AREA)
+        cv2.threshold(
+            self._small,
+            pipeline.THRESHOLD_LEVEL,
+            255,
+            cv2.THRESH_BINARY_INV,
+            dst=self._binary,
+        )
+
+        # The crop zone fills the canvas, so scale the outlines up to it
+        scale = np.array(
+            [self.canvas_size[0] / width, self.canvas_size[1] / height],
+            dtype=np.float32,
+        )
+        self._outlines = [
+            (contour.reshape(-1, 2) * scale).astype(np.int32)
+            for contour in pipeline.find_outline_contours(self._binary)
+        ]
+        return True
+
+    # Function to draw the latest outlines onto the canvas buffer
+    def draw(self, canvas):
+        cv2.polylines(canvas, self._outlines, True, self.color, 2)
+
+    # Function to find outlines less often while preview frames take most of
+    # their time budget, and more often again once they are quick
+    def adapt(self, frame_ms):
+        if frame_ms > self.budget_ms * 0.8 and self.skip < self.max_skip:
+            self.skip += 1
+        elif frame_ms < self.budget_ms * 0.4 and self.skip > 0:
+            self.skip -= 1
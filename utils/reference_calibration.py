@@ -1,13 +1,17 @@
 import cv2
 import os
 import json
-from picamera2 import Picamera2
 from tkinter import filedialog, Tk
-import matplotlib.pyplot as plt
 
-# Initialize the camera
-picam2 = Picamera2()
-picam2.configure(picam2.create_still_configuration(main={"size": (640, 480)}))
+
+# Function to open and configure the camera. Done on demand rather than at
+# import, so importing this module doesn't claim the camera from the app.
+def open_camera():
+    from picamera2 import Picamera2
+
+    picam2 = Picamera2()
+    picam2.configure(picam2.create_still_configuration(main={"size": (640, 480)}))
+    return picam2
 
 
 # Function to capture the reference image
@@ -26,9 +30,13 @@ def capture_reference_image():
     reference_image_path = os.path.join(output_directory, "reference_object.jpg")
 
     # Capture the reference image
-    picam2.start()
-    picam2.capture_file(reference_image_path)
-    picam2.stop()
+    picam2 = open_camera()
+    try:
+        picam2.start()
+        picam2.capture_file(reference_image_path)
+        picam2.stop()
+    finally:
+        picam2.close()
 
     return reference_image_path
 
@@ -0,0 +1,637 @@
+import argparse
+import asyncio
+import collections
+import json
+import mimetypes
+import os
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+import cv2
+import numpy as np
+
+import utils.barrel as barrel
+import utils.batch as batch
+import utils.combine as combine
+import utils.dxf as dxf
+import utils.layout as layout
+import utils.metrics as metrics
+import utils.persist as persist
+import utils.pipeline as pipeline
+from utils.manifest import SessionManifest
+from utils.trace_cache import TraceCache
+
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+LATENCY_WINDOW = 500  # Recent traces the status latencies are taken over
+
+# Each worker process opens the shared on-disk trace cache once
+_trace_cache = None
+
+
+# Raised by a handler to answer with an error status
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Function run in each worker process to trace one uploaded photo. The photo
+# is kept as uploaded, next to the SVG, like the kiosk's photos/.
+def _trace_upload(job):
+    global _trace_cache
+    (
+        image_data,
+        photo_path,
+        svg_path,
+        dxf_path,
+        crop_coords,
+        lens,
+        pixels_per_cm,
+        tolerance_mm,
+        use_trace_cache,
+        submitted,
+    ) = job
+    queued_ms = (time.monotonic() - submitted) * 1000
+    if use_trace_cache and _trace_cache is None:
+        _trace_cache = TraceCache()
+
+    timer = metrics.StageTimer()
+    with timer.stage("decode"):
+        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode the uploaded image")
+    with timer.stage("save_photo"):
+        persist.atomic_write(photo_path, image_data, sync_directory=False)
+
+    mtx, dist, calibration_size = (
+        (lens["mtx"], lens["dist"], lens["image_size"]) if lens else (None, None, None)
+    )
+    _, svg_info = pipeline.process_image(
+        image,
+        svg_path,
+        mtx,
+        dist,
+        crop_coords,
+        pixels_per_cm,
+        timer=timer,
+        calibration_size=calibration_size,
+        simplify_tolerance_mm=tolerance_mm,
+        trace_cache=_trace_cache if use_trace_cache else None,
+        dxf_path=dxf_path,
+    )
+    svg_info["queued_ms"] = round(queued_ms, 1)
+    svg_info["stages"] = {name: round(ms, 1) for name, ms in timer.stages.items()}
+    return svg_info
+
+
+# Function to read an optional query parameter, converting it with parse
+def _query_value(query, name, parse, default=None):
+    if name not in query:
+        return default
+    try:
+        return parse(query[name])
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Bad value for {name}")
+
+
+def _parse_crop(value):
+    crop = [int(v) for v in value.split(",")]
+    if len(crop) != 4 or crop[2] <= crop[0] or crop[3] <= crop[1]:
+        raise ValueError(value)
+    return crop
+
+
+# Function to check a JSON value is a number (or an int), and not a bool
+def _is_number(value, kind=(int, float)):
+    return isinstance(value, kind) and not isinstance(value, bool)
+
+
+def _parse_flag(value):
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise ValueError(value)
+
+
+# Traces photos posted by capture stations on a bounded pool of worker
+# processes, in a session folder laid out like the kiosk's.
+#
+#   POST /trace     body is a JPEG or PNG; query parameters crop=X0,Y0,X1,Y1,
+#                   pixels_per_cm, simplify (mm), undistort and dxf (0 or 1).
+#                   Answers with the sized SVG and its id in X-Part-Id.
+#   POST /combine   optional JSON body {"ids", "sheet_size_cm", "margin_cm",
+#                   "allow_rotation"}; combines the given or all uncombined
+#                   parts and answers with the combined SVG, or with the sheet
+#                   index when nesting onto sheets. If every part was traced
+#                   with dxf=1 the combined DXF(s) are written too.
+#   GET  /files/... any file in the session folder, e.g. a nested sheet
+#   GET  /status    queue depth, counts and recent latencies as JSON
+#
+# Once max_pending traces are waiting or running, more are turned away with
+# 503 so a busy server answers quickly instead of queueing without bound.
+class TraceServer:
+    def __init__(
+        self,
+        output_directory,
+        workers=None,
+        max_pending=None,
+        pixels_per_cm=pipeline.PIXELS_PER_CM,
+        lens=None,
+        simplify_tolerance_mm=pipeline.SIMPLIFY_TOLERANCE_MM,
+        use_trace_cache=True,
+    ):
+        self.output_directory = os.path.abspath(output_directory)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.workers
+        self.pixels_per_cm = pixels_per_cm
+        self.lens = lens
+        self.simplify_tolerance_mm = simplify_tolerance_mm
+        self.use_trace_cache = use_trace_cache
+
+        for folder in ("photos", "svgs", "dxfs"):
+            os.makedirs(os.path.join(self.output_directory, folder), exist_ok=True)
+        self.manifest = SessionManifest(self.output_directory)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._combine_lock = asyncio.Lock()
+
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self.queued_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self.started = time.monotonic()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    # Function to serve one connection, answering requests until the client
+    # closes it or asks to
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_UPLOAD_BYTES:
+                    await self._respond(
+                        writer,
+                        HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                        b"Upload too large\n",
+                        keep_alive=False,
+                    )
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                try:
+                    status, content_type, payload, extra_headers = await self.route(
+                        method, target, headers, body
+                    )
+                except HTTPError as e:
+                    status, content_type, payload, extra_headers = (
+                        e.status,
+                        "text/plain",
+                        f"{e}\n".encode(),
+                        {},
+                    )
+                except Exception as e:
+                    status, content_type, payload, extra_headers = (
+                        HTTPStatus.INTERNAL_SERVER_ERROR,
+                        "text/plain",
+                        f"{type(e).__name__}: {e}\n".encode(),
+                        {},
+                    )
+
+                keep_alive = version == "HTTP/1.1" and (
+                    headers.get("connection", "").lower() != "close"
+                )
+                await self._respond(
+                    writer, status, payload, content_type, extra_headers, keep_alive
+                )
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass  # Client went away or sent something that isn't HTTP
+        finally:
+            writer.close()
+
+    async def _respond(
+        self,
+        writer,
+        status,
+        payload,
+        content_type="text/plain",
+        extra_headers=None,
+        keep_alive=True,
+    ):
+        status = HTTPStatus(status)
+        lines = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(payload)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+            *(f"{name}: {value}" for name, value in (extra_headers or {}).items()),
+        ]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload)
+        await writer.drain()
+
+    # Function to pick the handler for a request. Handlers return
+    # (status, content type, body, extra headers).
+    async def route(self, method, target, headers, body):
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        path = url.path.rstrip("/") or "/"
+
+        if path == "/trace" and method == "POST":
+            return await self.trace(query, headers, body)
+        if path == "/combine" and method == "POST":
+            return await self.combine(body)
+        if path == "/status" and method == "GET":
+            return self.status()
+        if path.startswith("/files/") and method == "GET":
+            return self.file(urllib.parse.unquote(path[len("/files/") :]))
+        if path in ("/trace", "/combine", "/status"):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed")
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"No such endpoint {path}")
+
+    async def trace(self, query, headers, body):
+        if not body:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "No image uploaded")
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPError(
+                HTTPStatus.SERVICE_UNAVAILABLE,
+                f"{self.pending} traces are already queued, try again shortly",
+            )
+
+        crop_coords = _query_value(query, "crop", _parse_crop)
+        pixels_per_cm = _query_value(query, "pixels_per_cm", float, self.pixels_per_cm)
+        tolerance_mm = _query_value(
+            query, "simplify", float, self.simplify_tolerance_mm
+        )
+        undistort = _query_value(query, "undistort", _parse_flag, True)
+        export_dxf = _query_value(query, "dxf", _parse_flag, False)
+        if pixels_per_cm <= 0 or tolerance_mm < 0:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Bad calibration values")
+
+        capture_id = self.manifest.new_id()
+        ext = ".png" if headers.get("content-type") == "image/png" else ".jpg"
+        photo_path = os.path.join(
+            self.output_directory, "photos", f"captured_image_{capture_id}{ext}"
+        )
+        svg_path = os.path.join(
+            self.output_directory, "svgs", f"output_image_{capture_id}.svg"
+        )
+        dxf_path = (
+            os.path.join(
+                self.output_directory, "dxfs", f"output_image_{capture_id}.dxf"
+            )
+            if export_dxf
+            else None
+        )
+
+        submitted = time.monotonic()
+        self.pending += 1
+        try:
+            svg_info = await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                _trace_upload,
+                (
+                    body,
+                    photo_path,
+                    svg_path,
+                    dxf_path,
+                    crop_coords,
+                    self.lens if undistort else None,
+                    pixels_per_cm,
+                    tolerance_mm,
+                    self.use_trace_cache,
+                    submitted,
+                ),
+            )
+        except ValueError as e:
+            self.failed += 1
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+
+        latency_ms = (time.monotonic() - submitted) * 1000
+        self.completed += 1
+        self.latencies_ms.append(latency_ms)
+        self.queued_ms.append(svg_info["queued_ms"])
+
+        # The manifest is fsynced, so keep that off the event loop
+        await asyncio.to_thread(
+            self.manifest.record_capture,
+            capture_id,
+            svg_info,
+            photo_path,
+            crop=crop_coords,
+            pixels_per_cm=pixels_per_cm,
+            nodes=svg_info["nodes"],
+        )
+        with open(svg_path, "rb") as f:
+            svg_data = f.read()
+        return (
+            HTTPStatus.OK,
+            "image/svg+xml",
+            svg_data,
+            {
+                "X-Part-Id": capture_id,
+                "X-Width-Px": svg_info["width_px"],
+                "X-Height-Px": svg_info["height_px"],
+                "X-Latency-Ms": round(latency_ms, 1),
+            },
+        )
+
+    async def combine(self, body):
+        try:
+            options = json.loads(body) if body.strip() else {}
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body is not valid JSON")
+        if not isinstance(options, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+
+        if "ids" in options:
+            ids = options["ids"]
+            if not isinstance(ids, list) or not all(_is_number(i, int) for i in ids):
+                raise HTTPError(
+                    HTTPStatus.BAD_REQUEST, "ids must be a list of part ids"
+                )
+            missing = [i for i in ids if i not in self.manifest.captures]
+            if missing:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown part ids {missing}")
+            svg_files = await asyncio.to_thread(
+                lambda: [self.manifest.svg_info(capture_id) for capture_id in ids]
+            )
+            lost = [i for i, svg_info in zip(ids, svg_files) if svg_info is None]
+            if lost:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"SVGs of parts {lost} are lost")
+        else:
+            svg_files = await asyncio.to_thread(self.manifest.pending_svg_files)
+        if not svg_files:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "No SVG files to combine")
+
+        sheet_size_cm = options.get("sheet_size_cm")
+        if sheet_size_cm is not None and not (
+            isinstance(sheet_size_cm, list)
+            and len(sheet_size_cm) == 2
+            and all(_is_number(v) and v > 0 for v in sheet_size_cm)
+        ):
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "sheet_size_cm must be [width, height] in cm"
+            )
+        margin_cm = options.get("margin_cm", 0.5)
+        if not _is_number(margin_cm) or margin_cm < 0:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "margin_cm must be 0 or more")
+        allow_rotation = options.get("allow_rotation", True)
+        if not isinstance(allow_rotation, bool):
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "allow_rotation must be true or false"
+            )
+
+        scales = {
+            self.manifest.captures[svg_info["id"]].get(
+                "pixels_per_cm", self.pixels_per_cm
+            )
+            for svg_info in svg_files
+        }
+        if len(scales) > 1:
+            raise HTTPError(
+                HTTPStatus.CONFLICT, "The parts were traced at different scales"
+            )
+        pixels_per_cm = scales.pop()
+
+        # Combines write to the same files, so run them one at a time, off
+        # the event loop
+        async with self._combine_lock:
+            return await asyncio.to_thread(
+                self._combine,
+                svg_files,
+                pixels_per_cm,
+                sheet_size_cm,
+                margin_cm,
+                allow_rotation,
+            )
+
+    def _combine(
+        self, svg_files, pixels_per_cm, sheet_size_cm, margin_cm, allow_rotation
+    ):
+        combined_svg_path = os.path.join(self.output_directory, "combined_output.svg")
+        combined_dxf_path = os.path.join(self.output_directory, "combined_output.dxf")
+        ids = [svg_info["id"] for svg_info in svg_files]
+
+        # Parts traced without dxf=1 have no DXF to combine
+        export_dxf = all("dxf_path" in svg_info for svg_info in svg_files)
+
+        if sheet_size_cm:
+            sheet_paths, sheets = combine.layout_svgs(
+                svg_files,
+                combined_svg_path,
+                sheet_size_cm,
+                pixels_per_cm,
+                margin_cm,
+                allow_rotation,
+            )
+            extra_paths = {}
+            if export_dxf:
+                # Same placements as the SVG sheets
+                extra_paths["dxf"] = dxf.combine_dxfs(
+                    svg_files, combined_dxf_path, pixels_per_cm, sheets
+                )
+            index_path = combine.write_sheet_index(
+                combine.sheet_index_path(combined_svg_path),
+                sheet_paths,
+                sheets,
+                svg_files,
+                pixels_per_cm,
+                extra_paths,
+            )
+            self.manifest.record_combine(
+                ids, sheet_paths + extra_paths.get("dxf", []) + [index_path]
+            )
+            with open(index_path, "rb") as f:
+                index_data = f.read()
+            return (
+                HTTPStatus.OK,
+                "application/json",
+                index_data,
+                {
+                    "X-Sheets": len(sheets),
+                    "X-Utilization": f"{layout.total_utilization(sheets):.4f}",
+                },
+            )
+
+        combine.combine_svgs(svg_files, combined_svg_path, pixels_per_cm)
+        combined_paths = [combined_svg_path]
+        headers = {"X-Parts": len(ids)}
+        if export_dxf:
+            combined_paths += dxf.combine_dxfs(
+                svg_files, combined_dxf_path, pixels_per_cm
+            )
+            headers["X-Dxf"] = f"/files/{os.path.basename(combined_dxf_path)}"
+        self.manifest.record_combine(ids, combined_paths)
+        with open(combined_svg_path, "rb") as f:
+            svg_data = f.read()
+        return HTTPStatus.OK, "image/svg+xml", svg_data, headers
+
+    def status(self):
+        latencies = list(self.latencies_ms)
+        queued = list(self.queued_ms)
+
+        def rounded(value):
+            return None if value is None else round(value, 1)
+
+        status = {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "queue_depth": max(0, self.pending - self.workers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "uncombined": len(self.manifest.uncombined_ids),
+            "latency_ms": {
+                "p50": rounded(metrics.percentile(latencies, 0.5)),
+                "p95": rounded(metrics.percentile(latencies, 0.95)),
+            },
+            "queued_ms": {
+                "p50": rounded(metrics.percentile(queued, 0.5)),
+                "p95": rounded(metrics.percentile(queued, 0.95)),
+            },
+            "uptime_s": round(time.monotonic() - self.started, 1),
+        }
+        return (
+            HTTPStatus.OK,
+            "application/json",
+            json.dumps(status, indent=2).encode(),
+            {},
+        )
+
+    # Function to serve a file from the session folder, and nothing outside it
+    def file(self, relative_path):
+        path = os.path.realpath(os.path.join(self.output_directory, relative_path))
+        if not path.startswith(os.path.realpath(self.output_directory) + os.sep):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "No such file")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "No such file")
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return HTTPStatus.OK, content_type, data, {}
+
+
+# Function to run the server until interrupted
+async def serve(trace_server, host, port):
+    server = await asyncio.start_server(trace_server.handle_connection, host, port)
+    address = ", ".join(
+        f"http://{sock.getsockname()[0]}:{sock.getsockname()[1]}"
+        for sock in server.sockets
+    )
+    print(
+        f"Tracing on {address} with {trace_server.workers} workers, "
+        f"saving to {trace_server.output_directory}"
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Trace tool photos uploaded by capture stations over HTTP."
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="address to listen on, 0.0.0.0 for every interface "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="port to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="server_output",
+        help="session folder for the photos, SVGs and sheets (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--calibration",
+        help="calibration_data.json from reference_calibration.py, used when an "
+        f"upload gives no pixels_per_cm (default: {pipeline.PIXELS_PER_CM})",
+    )
+    parser.add_argument(
+        "--lens-calibration",
+        default=barrel.CALIBRATION_FILE,
+        help="lens calibration file from utils/calibrate.py "
+        "(default: %(default)s if it exists, else the values in barrel.py)",
+    )
+    parser.add_argument(
+        "--simplify",
+        type=float,
+        default=pipeline.SIMPLIFY_TOLERANCE_MM,
+        metavar="MM",
+        help="default outline simplification in mm (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-trace-cache",
+        action="store_true",
+        help="trace every photo again instead of reusing cached traces",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="number of worker processes (default: all cores)",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        help="traces to accept at once before answering 503 " "(default: 4 per worker)",
+    )
+    args = parser.parse_args(argv)
+
+    trace_server = TraceServer(
+        args.output,
+        workers=args.workers,
+        max_pending=args.max_pending,
+        pixels_per_cm=(
+            batch.load_pixels_per_cm(args.calibration)
+            if args.calibration
+            else pipeline.PIXELS_PER_CM
+        ),
+        lens=barrel.load_calibration(args.lens_calibration),
+        simplify_tolerance_mm=args.simplify,
+        use_trace_cache=not args.no_trace_cache,
+    )
+    try:
+        asyncio.run(serve(trace_server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        trace_server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Douglas-Peucker simplification of traced outlines, so the SVGs carry no
+# more nodes than the cut needs
+import re
+
+import cv2
+import numpy as np
+
+# Curves are flattened into this many line segments before simplifying
+CURVE_STEPS = 8
+
+_TOKEN = re.compile(r"[MmLlCcZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_ARGUMENTS = {"m": 2, "l": 2, "c": 6, "z": 0}
+
+
+# Function to split SVG path data into (command, arguments) pairs, one per
+# segment. Only the commands potrace emits (M, L, C, Z) are understood.
+def _segments(d):
+    tokens = _TOKEN.findall(d)
+    i = 0
+    command = None
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in "Zz":
+                yield command, ()
+                continue
+        count = _ARGUMENTS[command.lower()]
+        yield command, tuple(float(v) for v in tokens[i : i + count])
+        i += count
+        # Coordinates after a moveto are implicit linetos
+        if command == "M":
+            command = "L"
+        elif command == "m":
+            command = "l"
+
+
+# Function to count the nodes (segment end points) in traced path data
+def count_nodes(traced):
+    return sum(
+        1 for d in traced["paths"] for command, _ in _segments(d) if command not in "Zz"
+    )
+
+
+# Function to turn path data into closed polylines, flattening curves
+def _polylines(d, curve_steps=CURVE_STEPS):
+    polylines = []
+    points = []
+    x = y = 0.0
+    start = (0.0, 0.0)
+    t = np.linspace(0, 1, curve_steps + 1)[1:, None]
+    for command, args in _segments(d):
+        relative = command.islower()
+        if command in "Mm":
+            if len(points) > 1:
+                polylines.append(points)
+            x, y = (x + args[0], y + args[1]) if relative else args
+            start = (x, y)
+            points = [start]
+        elif command in "Ll":
+            x, y = (x + args[0], y + args[1]) if relative else args
+            points.append((x, y))
+        elif command in "Cc":
+            p0 = np.array([x, y])
+            p1, p2, p3 = (np.array(args[i : i + 2]) for i in (0, 2, 4))
+            if relative:
+                p1, p2, p3 = p0 + p1, p0 + p2, p0 + p3
+            curve = (
+                (1 - t) ** 3 * p0
+                + 3 * (1 - t) ** 2 * t * p1
+                + 3 * (1 - t) * t**2 * p2
+                + t**3 * p3
+            )
+            points.extend(map(tuple, curve))
+            x, y = p3
+        else:
+            x, y = start
+    if len(points) > 1:
+        polylines.append(points)
+    return polylines
+
+
+# Function to get the scale of a potrace group transform, e.g. 0.1 for
+# "translate(0,480) scale(0.1,-0.1)"
+def _transform_scale(transform):
+    match = re.search(r"scale\(\s*([-+\d.eE]+)", transform or "")
+    return abs(float(match.group(1))) if match else 1.0
+
+
+# Function to simplify traced path data with Douglas-Peucker, so no point
+# moves more than tolerance_px image pixels. Curves become straight segments.
+def simplify_traced(traced, tolerance_px):
+    if tolerance_px <= 0:
+        return traced
+
+    # Path coordinates may be scaled by the group transform
+    epsilon = tolerance_px / _transform_scale(traced["transform"])
+
+    path_data = []
+    for d in traced["paths"]:
+        for polyline in _polylines(d):
+            points = np.array(polyline, dtype=np.float32).reshape(-1, 1, 2)
+            simplified = cv2.approxPolyDP(points, epsilon, True).reshape(-1, 2)
+            if len(simplified) < 3:
+                continue  # Smaller than the tolerance
+            coordinates = " ".join(f"{x:.1f} {y:.1f}" for x, y in simplified)
+            path_data.append(f"M{coordinates}z")
+
+    return {
+        "transform": traced["transform"],
+        "paths": [" ".join(path_data)] if path_data else [],
+    }
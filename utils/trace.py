@@ -0,0 +1,123 @@
+import subprocess
+import xml.etree.ElementTree as ET
+
+import cv2
+
+import utils.persist as persist
+
+# Use the potrace library binding (pypotrace) when it is installed, otherwise
+# feed the potrace command over pipes. The pure-Python "potracer" package
+# installs under the same name but is much slower than the command, so skip it.
+try:
+    import potrace
+except ImportError:
+    potrace = None
+else:
+    if hasattr(potrace, "potrace"):
+        potrace = None
+
+SVG_NS = "http://www.w3.org/2000/svg"
+
+# Default potrace tracing parameters (same as the potrace command)
+TURDSIZE = 2
+ALPHAMAX = 1.0
+OPTTOLERANCE = 0.2
+
+
+# Function to format a coordinate compactly
+def _fmt(value):
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+# Function to trace a mask with the potrace library binding
+def _trace_with_binding(mask_inv):
+    # The binding fills non-zero pixels, so mark the black outline
+    bitmap = potrace.Bitmap(mask_inv < 128)
+    path = bitmap.trace(
+        turdsize=TURDSIZE,
+        turnpolicy=potrace.TURNPOLICY_MINORITY,
+        alphamax=ALPHAMAX,
+        opticurve=1,
+        opttolerance=OPTTOLERANCE,
+    )
+
+    # The binding returns coordinates in image pixels, so no transform is needed.
+    # All curves go into one path so holes are cut out like potrace -s does.
+    path_data = []
+    for curve in path:
+        x, y = curve.start_point
+        commands = [f"M{_fmt(x)} {_fmt(y)}"]
+        for segment in curve:
+            if segment.is_corner:
+                points = (segment.c, segment.end_point)
+                commands.append(
+                    "L" + " ".join(f"{_fmt(x)} {_fmt(y)}" for x, y in points)
+                )
+            else:
+                points = (segment.c1, segment.c2, segment.end_point)
+                commands.append(
+                    "C" + " ".join(f"{_fmt(x)} {_fmt(y)}" for x, y in points)
+                )
+        commands.append("z")
+        path_data.append("".join(commands))
+
+    return {"transform": None, "paths": [" ".join(path_data)] if path_data else []}
+
+
+# Function to trace a mask with the potrace command, without temp files
+def _trace_with_command(mask_inv):
+    ok, pgm = cv2.imencode(".pgm", mask_inv)
+    if not ok:
+        raise ValueError("Could not encode the outline mask")
+
+    result = subprocess.run(
+        ["potrace", "-s", "-o", "-", "-"],
+        input=pgm.tobytes(),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+
+    # Keep the group transform and path data, the document is rebuilt later
+    root_svg = ET.fromstring(result.stdout)
+    group = root_svg.find(f"{{{SVG_NS}}}g")
+    if group is None:
+        return {"transform": None, "paths": []}
+    return {
+        "transform": group.get("transform"),
+        "paths": [path.get("d") for path in group.iter(f"{{{SVG_NS}}}path")],
+    }
+
+
+# Function to trace a black-on-white outline mask into in-memory SVG path data
+def trace_mask(mask_inv):
+    if potrace is not None:
+        return _trace_with_binding(mask_inv)
+    return _trace_with_command(mask_inv)
+
+
+# Function to build a sized SVG document from traced path data
+def svg_document(traced, width_px, height_px, pixels_per_cm):
+    # Compute the width and height in centimeters
+    width_cm = width_px / pixels_per_cm
+    height_cm = height_px / pixels_per_cm
+
+    group_attrs = ' fill="#000000" stroke="none"'
+    if traced["transform"]:
+        group_attrs = f' transform="{traced["transform"]}"' + group_attrs
+
+    paths = "\n".join(f'<path d="{d}"/>' for d in traced["paths"])
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="{SVG_NS}" version="1.1" '
+        f'width="{width_cm}cm" height="{height_cm}cm" '
+        f'viewBox="0 0 {width_px} {height_px}">\n'
+        f"<g{group_attrs}>\n{paths}\n</g>\n"
+        "</svg>\n"
+    )
+
+
+# Function to write a sized SVG file in one go, atomically or through a
+# persist.WriteBehind
+def write_svg(svg_path, traced, width_px, height_px, pixels_per_cm, writer=None):
+    svg_data = svg_document(traced, width_px, height_px, pixels_per_cm)
+    persist.write_file(svg_path, svg_data.encode("UTF-8"), writer)
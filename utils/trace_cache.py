@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import utils.trace as trace
+
+# Traces are kept per machine, outside any session folder
+CACHE_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "shadowboards",
+    "traces",
+)
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+CACHE_VERSION = 1
+
+
+# On-disk memo of traced (and simplified) path data, keyed by a hash of the
+# outline mask, the tracing parameters and the lens calibration. One JSON
+# file per entry; the least recently used files are deleted once the cache
+# is over max_bytes. Safe to share between threads and processes.
+class TraceCache:
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = None  # key -> (last used, size), loaded on first use
+        self._total_bytes = 0
+
+    # Function to build the cache key for a mask traced with the current
+    # tracer settings and the given extra parameters
+    def key(self, mask, **params):
+        digest = hashlib.sha1()
+        digest.update(f"{mask.shape}{mask.dtype}".encode())
+        digest.update(np.ascontiguousarray(mask).tobytes())
+        settings = {
+            "version": CACHE_VERSION,
+            "backend": "binding" if trace.potrace is not None else "command",
+            "turdsize": trace.TURDSIZE,
+            "alphamax": trace.ALPHAMAX,
+            "opttolerance": trace.OPTTOLERANCE,
+            **{
+                name: np.asarray(value).tolist() if value is not None else None
+                for name, value in params.items()
+            },
+        }
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        try:
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        self._entries[entry.name[:-5]] = (stat.st_mtime, stat.st_size)
+        except FileNotFoundError:
+            pass
+        self._total_bytes = sum(size for _, size in self._entries.values())
+
+    # Function to get the cached value for key, or None
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = json.loads(f.read())
+            now = time.time()
+            os.utime(path, (now, now))  # Mark it as recently used
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if self._entries is not None and key in self._entries:
+                self._entries[key] = (now, self._entries[key][1])
+        return value
+
+    # Function to store a value, evicting the least recently used entries
+    def put(self, key, value):
+        data = json.dumps(value).encode()
+        path = self._path(key)
+        try:
+            # No fsync: a damaged entry is just a miss
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Could not save trace cache entry: {e}")
+            return
+
+        with self._lock:
+            self._load_index()
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][1]
+            self._entries[key] = (time.time(), len(data))
+            self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Other processes may have used, added or removed entries since the
+        # index was read, so read it again before picking the oldest
+        self._entries = None
+        self._load_index()
+        for key in sorted(self._entries, key=lambda k: self._entries[k][0]):
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            _, size = self._entries.pop(key)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    # Function to get the hit and miss counts so far
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,122 @@
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+# Remap tables are saved next to the calibration constants so the next start
+# can load them instead of rebuilding them
+CACHE_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "undistort_cache"
+)
+
+# In-memory cache of (map1, map2, roi) keyed by calibration and resolution
+_maps = {}
+
+
+# Function to build a stable key for a lens model at a given resolution
+def _cache_key(mtx, dist, size):
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(mtx, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(dist, dtype=np.float64).tobytes())
+    digest.update(f"{size[0]}x{size[1]}".encode())
+    return digest.hexdigest()[:16]
+
+
+# Function to build the fixed-point remap tables and ROI for a lens model
+def build_undistort_maps(mtx, dist, size):
+    newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, size, 1, size)
+    map1, map2 = cv2.initUndistortRectifyMap(
+        mtx, dist, None, newcameramtx, size, cv2.CV_16SC2
+    )
+    return map1, map2, tuple(int(v) for v in roi)
+
+
+# Function to load the remap tables from disk, returning None if unavailable
+def _load_maps(path):
+    try:
+        with np.load(path) as data:
+            return data["map1"], data["map2"], tuple(int(v) for v in data["roi"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+# Function to save the remap tables to disk without leaving partial files
+def _save_maps(path, maps):
+    map1, map2, roi = maps
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, map1=map1, map2=map2, roi=np.array(roi))
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not save undistort cache {path}: {e}")
+
+
+# Function to get the remap tables for a lens model, building them only once
+def get_undistort_maps(mtx, dist, size, cache_directory=CACHE_DIRECTORY):
+    size = (int(size[0]), int(size[1]))
+    key = _cache_key(mtx, dist, size)
+    if key in _maps:
+        return _maps[key]
+
+    maps = None
+    path = None
+    if cache_directory:
+        path = os.path.join(cache_directory, f"undistort_{key}.npz")
+        maps = _load_maps(path)
+
+    if maps is None:
+        maps = build_undistort_maps(mtx, dist, size)
+        if path:
+            _save_maps(path, maps)
+
+    _maps[key] = maps
+    return maps
+
+
+# Function to scale a camera matrix calibrated at one resolution so it can
+# be used at another, e.g. a full-sensor still
+def scale_camera_matrix(mtx, from_size, to_size):
+    scaled = np.array(mtx, dtype=np.float64)
+    scaled[0] *= to_size[0] / from_size[0]  # fx, cx
+    scaled[1] *= to_size[1] / from_size[1]  # fy, cy
+    return scaled
+
+
+# Function to undistort an image and crop it to the valid ROI
+def undistort(image, mtx, dist, cache_directory=CACHE_DIRECTORY):
+    h, w = image.shape[:2]
+    map1, map2, roi = get_undistort_maps(mtx, dist, (w, h), cache_directory)
+
+    dst = cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
+
+    # crop the image
+    x, y, w, h = roi
+    return dst[y : y + h, x : x + w]
+
+
+# Function to undistort only the crop zone of an image. crop_coords are in
+# the coordinates of undistort()'s output, and the result is the same as
+# cropping that output, but only the crop zone's pixels are remapped.
+def undistort_crop(image, mtx, dist, crop_coords, cache_directory=CACHE_DIRECTORY):
+    h, w = image.shape[:2]
+    map1, map2, roi = get_undistort_maps(mtx, dist, (w, h), cache_directory)
+
+    # Clamp the crop zone to the valid ROI, then offset it into the maps
+    rx, ry, rw, rh = roi
+    x0, y0, x1, y1 = map(int, crop_coords)
+    x0, x1 = max(0, min(x0, rw)), max(0, min(x1, rw))
+    y0, y1 = max(0, min(y0, rh)), max(0, min(y1, rh))
+    if x1 <= x0 or y1 <= y0:
+        return image[0:0, 0:0]
+
+    # The maps hold absolute source coordinates, so slices of them can be
+    # used against the whole source image
+    return cv2.remap(
+        image,
+        map1[ry + y0 : ry + y1, rx + x0 : rx + x1],
+        map2[ry + y0 : ry + y1, rx + x0 : rx + x1],
+        cv2.INTER_LINEAR,
+    )